@@ -1,40 +1,179 @@
+import copy
 import json
 import os
-import sys
+import queue
+import re
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 import requests
 from dotenv import load_dotenv
 
-from config import (service_url, dataset_names, kml_file)
+from config import (service_url, dataset_names, kml_file, pool_size, max_workers,
+                    page_size, options_batch_size, footprint_filter, queue_size, state_db, lookback_days,
+                    cache_path, cache_ttls, cache_max_size, api_key_path, api_key_ttl,
+                    retry_attempts, rate_limits, rate_limit_path, dataset_priorities)
+from cache import ApiKeyCache, ResponseCache
 from download import Download
+from geometry import FootprintFilter, make_spatial_filter
+from kml import KMLPolygons
+from errors import (EROSError, AuthError, RateLimitError, TransientError,
+                    parse_retry_after, raise_for_response, retry_delay)
+from poller import DownloadPoller, expected_downloads
+from ratelimit import RateLimiter
+from state import SyncState
+
+# download-options accepts at most this many entityIds per call
+MAX_ENTITY_IDS = 50000
+# [PRIORITY] of datasets that are not listed
+DEFAULT_PRIORITY = 10
+# Marks the end of a pipeline stage's output
+_DONE = object()
 
 
 class DownloadEORS(Download):
 
-    def __init__(self, date_range: int = 14):
-        super().__init__(date_range, 'EROS')
+    def __init__(self,
+                 date_range: int = 14,
+                 pool_size: int = pool_size,
+                 service_url: str = service_url,
+                 state_db: str = state_db,
+                 cache_path: str = cache_path,
+                 api_key_path: str = api_key_path,
+                 kml_file: str = kml_file):
+        super().__init__(date_range, 'EROS', pool_size)
         load_dotenv()
-        self.service_url = service_url
         self.username = os.getenv('EROS_user')
         self.password = os.getenv('EROS_password')
         self.service_url = service_url
-        self.logger.info(f'Logging into {service_url}')
-        payload = {'username': self.username, 'password': self.password}
-        self.api_key = self.send_request('login', payload)
-        lower_left, upper_right = self.get_area_rect_from_klm(kml_file)
-        self.spatial_filter = {'filterType': 'mbr',
-                               'lowerLeft': lower_left,
-                               'upperRight': upper_right}
+        self.rate_limiter = RateLimiter(rate_limits, rate_limit_path)
+        self.cache = (ResponseCache(cache_path, cache_ttls, cache_max_size, f'{service_url} {self.username}')
+                      if cache_path else None)
+        self.api_key_cache = ApiKeyCache(api_key_path, api_key_ttl) if api_key_path else None
+        self.login_lock = threading.Lock()
+        # shared with the with_aoi copies, so a refreshed key reaches them all
+        self._auth = {}
+        self.api_key = self.login()
+        polygons = KMLPolygons.read(kml_file)
+        self.spatial_filter = make_spatial_filter(polygons)
+        self.footprint = FootprintFilter(polygons) if footprint_filter else None
         self.temporal_filter = dict(start=self.start, end=self.end)
         self.dataset_names = dataset_names
+        self.aoi = kml_file
+        self.state = SyncState(state_db) if state_db else None
+        self.searched_datasets = set()
+        self.entity_datasets = {}
+
+    @property
+    def api_key(self) -> str:
+        return self._auth.get('api_key')
+
+    @api_key.setter
+    def api_key(self, api_key):
+        self._auth['api_key'] = api_key
+
+    def with_aoi(self, aoi, polygons) -> 'DownloadEORS':
+        """
+        This function returns a client for another area of interest. It
+        shares this client's HTTP session, API key, rate limits, caches and
+        sync state, so no new login is needed. Close only the original.
+
+        Parameters
+        ----------
+        aoi : str
+            name of the area in the sync state.
+        polygons : kml.KMLPolygons
+            polygons of the area.
+
+        Returns
+        -------
+        DownloadEORS
+            client searching the area.
+        """
+        client = copy.copy(self)
+        client.aoi = aoi
+        client.spatial_filter = make_spatial_filter(polygons)
+        client.footprint = FootprintFilter(polygons) if self.footprint is not None else None
+        client.searched_datasets = set()
+        return client
+
+    def login(self, expired_key=None) -> str:
+        """
+        This function logs into the API. With the API key cache, a cached key
+        that has not expired is reused instead.
+
+        Parameters
+        ----------
+        expired_key : str, optional
+            a key the server rejected, so it is not reused. The default is None.
+
+        Returns
+        -------
+        str
+            API key.
+
+        """
+        def login():
+            self.logger.info(f'Logging into {self.service_url}')
+            payload = {'username': self.username, 'password': self.password}
+            return self.send_request('login', payload)
+
+        if self.api_key_cache is None:
+            return login()
+        return self.api_key_cache.get_or_login(self.service_url, self.username, login, expired_key)
+
+    def refresh_api_key(self, expired_key) -> str:
+        """
+        This function replaces an API key the server rejected. Threads that
+        hit the same rejected key share one new login.
+
+        Parameters
+        ----------
+        expired_key : str
+            the rejected key.
+
+        Returns
+        -------
+        str
+            new API key.
+
+        """
+        with self.login_lock:
+            if self.api_key == expired_key:
+                self.logger.info('API key was rejected, logging in again')
+                self.api_key = self.login(expired_key)
+        return self.api_key
+
+    def _post(self, url, json_data, api_key):
+        headers = {} if api_key is None else {'X-Auth-Token': api_key}
+        try:
+            response = self.session.post(url, json_data, headers=headers, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientError(f'Failed to fetch remote {url} info ({e})') from e
+        with response:
+            try:
+                output = json.loads(response.text)
+            except ValueError:
+                output = None
+            raise_for_response(url, response.status_code, output,
+                               parse_retry_after(response.headers.get('Retry-After')))
+        return output['data']
 
     def send_request(self,
                      request,
                      data,
-                     api_key=None):
+                     api_key=None,
+                     attempts: int = retry_attempts):
         """
-        This function handles the comunication with the API server
+        This function handles the comunication with the API server.
+        When the response cache is on, search responses are served from it.
+        Each attempt waits for the endpoint's rate-limit budget. Rate-limit,
+        server and network errors are retried with exponential backoff (or
+        after the server's Retry-After). A request rejected for an expired
+        API key is sent again once with a new key.
 
         Parameters
         ----------
@@ -44,6 +183,18 @@ class DownloadEORS(Download):
             payload - used as time and location filter.
         api_key : str, optional
             API key to comunicate with the API. The default is None.
+        attempts : int, optional
+            max number of attempts. The default is attempts from the
+            [RETRY] section of the cfng file.
+
+        Raises
+        ------
+        AuthError
+            the credentials or the API key were rejected.
+        RateLimitError, TransientError
+            the request still failed after all the attempts.
+        APIError
+            the API rejected the request.
 
         Returns
         -------
@@ -51,46 +202,75 @@ class DownloadEORS(Download):
             Requested data.
 
         """
+        if self.cache is not None:
+            cached = self.cache.get(request, data)
+            if cached is not None:
+                return cached
 
         json_data = json.dumps(data)
         url = self.service_url + request
-        if api_key is None:
-            response = requests.post(url, json_data)
-        else:
-            headers = {'X-Auth-Token': api_key}
-            response = requests.post(url, json_data, headers=headers)
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                self.rate_limiter.acquire(request)
+                output = self._post(url, json_data, api_key)
+                break
+            except AuthError as e:
+                if api_key is None or request == 'logout' or refreshed:
+                    self.logger.warning(str(e))
+                    raise
+                refreshed = True
+                api_key = self.refresh_api_key(api_key)
+            except (RateLimitError, TransientError) as e:
+                attempt += 1
+                if attempt >= attempts:
+                    self.logger.warning(f'{e} (gave up after {attempt} attempts)')
+                    raise
+                delay = retry_delay(attempt, e)
+                self.logger.warning(f'{e}. Retrying in {delay:.1f} seconds')
+                time.sleep(delay)
+            except EROSError as e:
+                self.logger.warning(str(e))
+                raise
+
+        if self.cache is not None:
+            self.cache.put(request, data, output)
+        return output
+
+    def _search_dataset(self, dataset) -> list:
+        """
+        This function runs a single dataset-search for time and place
 
-        try:
-            http_status_code = response.status_code
-            if response is None:
-                self.logger.warning('No output from service')
-                sys.exit()
-            output = json.loads(response.text)
-            if output['errorCode'] is not None:
-                self.logger.warning(output['errorCode'], 
-                                    '- ', 
-                                    output['errorMessage'])
-                sys.exit()
-            if http_status_code == 404:
-                self.logger.warning('404 Not Found')
-                sys.exit()
-            elif http_status_code == 401:
-                self.logger.warning('401 Unauthorized')
-                sys.exit()
-            elif http_status_code == 400:
-                self.logger.warning('Error Code', http_status_code)
-                sys.exit()
-        except Exception as e:
-            self.logger.warning(f'Failed to fetch remote {url} info ({e})')
-            response.close()
-            sys.exit()
-        response.close()
-        return output['data']
+        Parameters
+        ----------
+        dataset : str
+            dataset name.
 
-    def get_available_datasets(self) -> dict:
+        Returns
+        -------
+        list
+            the datasets matching the name, time and place.
+
+        """
+        payload = {'datasetName': dataset,
+                   'spatialFilter': self.spatial_filter,
+                   'temporalFilter': self.temporal_filter}
+
+        self.logger.info(f'Searching dataset name: {dataset}...')
+        return self.send_request('dataset-search', payload, self.api_key)
+
+    def get_available_datasets(self, max_workers: int = max_workers) -> dict:
         """
         This function fetch the datasets with avaliabole data for time 
-        and place. The time range and place are a class variables
+        and place. The time range and place are a class variables.
+        The dataset searches are sent concurrently.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            max number of dataset searches in flight at once. The default
+            is max_workers from the cfng file.
 
         Returns
         -------
@@ -100,20 +280,150 @@ class DownloadEORS(Download):
 
         """
         _datasets = {}
-        for dataset in self.dataset_names:
-            payload = {'datasetName': dataset,
-                       'spatialFilter': self.spatial_filter,
-                       'temporalFilter': self.temporal_filter}
-
-            self.logger.info(f'Searching dataset name: {dataset}...')
-            dataset_data = self.send_request('dataset-search', payload, self.api_key)
-            self.logger.info(f'Found {len(dataset_data)} datasets')
-            if len(dataset_data):
-                _datasets[dataset] = dataset_data[0]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(self._search_dataset, self.dataset_names)
+            for dataset, dataset_data in zip(self.dataset_names, results):
+                self.logger.info(f'Found {len(dataset_data)} datasets for {dataset}')
+                if len(dataset_data):
+                    _datasets[dataset] = dataset_data[0]
         return _datasets
 
+    def acquisition_filter(self, dataset_name, lookback_days: int = lookback_days) -> dict:
+        """
+        This function returns the scene-search time filter of a dataset.
+        When the sync state has a window for the AOI and dataset, only the
+        time since the end of that window, less lookback_days, is searched.
+        The overlap finds scenes acquired before the last run but ingested
+        or made available since, and the scenes it finds again were already
+        downloaded, so they are skipped without a download-options call.
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias.
+        lookback_days : int, optional
+            days before the end of the last window to search again. The
+            default is lookback_days from the [STATE] section of the cfng
+            file.
+
+        Returns
+        -------
+        dict
+            {'start': start date, 'end': end date}.
+
+        """
+        if self.state is not None:
+            last_end = self.state.last_end(self.aoi, dataset_name)
+            if last_end is not None:
+                start = datetime.strptime(last_end, '%Y-%m-%d') - timedelta(days=lookback_days)
+                start = start.strftime('%Y-%m-%d')
+                if start > self.start:
+                    return dict(start=start, end=self.end)
+        return self.temporal_filter
+
+    def iter_scenes(self,
+                    dataset_name,
+                    page_size: int = page_size):
+        """
+        This function pages through the scene-search results of a dataset
+        for time and place, following nextRecord until totalHits are fetched.
+        The scenes are yielded as each page arrives. With the footprint
+        filter, scenes that miss the KML polygons are dropped.
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias to search.
+        page_size : int, optional
+            number of scenes to request per page. The default is page_size
+            from the cfng file.
+
+        Yields
+        ------
+        dict
+            scene-search result for each scene.
+
+        """
+        acquisition_filter = self.acquisition_filter(dataset_name)
+        starting_number = 1
+        while True:
+            payload = {'datasetName': dataset_name,
+                       'maxResults': page_size,
+                       'startingNumber': starting_number,
+                       'sceneFilter': {'spatialFilter': self.spatial_filter,
+                                       'acquisitionFilter': acquisition_filter}}
+            scenes = self.send_request('scene-search', payload, self.api_key)
+            results = scenes['results']
+            if self.footprint is not None:
+                results = self.footprint.filter(results)
+                if len(results) < len(scenes['results']):
+                    self.logger.info(f'{len(scenes["results"]) - len(results)} of '
+                                     f'{len(scenes["results"])} scenes miss the area')
+            yield from results
+
+            next_record = scenes.get('nextRecord')
+            records_returned = scenes['recordsReturned']
+            if (records_returned <= 0
+                    or starting_number + records_returned > scenes['totalHits']
+                    or not next_record
+                    or next_record <= starting_number):
+                break
+            starting_number = next_record
+        self.searched_datasets.add(dataset_name)
+
+    def get_download_options(self,
+                             dataset_name,
+                             scene_ids,
+                             batch_size: int = options_batch_size,
+                             max_workers: int = max_workers) -> list:
+        """
+        This function fetch the download options for a list of scenes.
+        Scenes already downloaded according to the sync state are skipped.
+        The scene list is split into batches of at most MAX_ENTITY_IDS
+        and the batches are sent concurrently.
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias of the scenes.
+        scene_ids : list
+            entityId of each scene.
+        batch_size : int, optional
+            number of entityIds per download-options call. The default is
+            options_batch_size from the cfng file.
+        max_workers : int, optional
+            max number of download-options calls in flight at once. The
+            default is max_workers from the cfng file.
+
+        Returns
+        -------
+        list
+            entityId and productId dict for each available product.
+
+        """
+        if self.state is not None:
+            known_entities = self.state.known_entities(self.aoi, dataset_name)
+            scene_ids = [scene_id for scene_id in scene_ids if scene_id not in known_entities]
+        batch_size = max(1, min(batch_size, MAX_ENTITY_IDS))
+        batches = [scene_ids[i: i + batch_size] for i in range(0, len(scene_ids), batch_size)]
+
+        def request_options(batch):
+            payload = {'datasetName': dataset_name, 'entityIds': batch}
+            return self.send_request('download-options', payload, self.api_key) or []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(request_options, batches))
+        downloads = [{'entityId': product['entityId'], 'productId': product['id']}
+                     for download_options in results
+                     for product in download_options
+                     if product['available']]
+        for download in downloads:
+            self.entity_datasets[download['entityId']] = dataset_name
+        return downloads
+
     def get_scenes_for_datasets(self,
-                                _datasets) -> dict:
+                                _datasets,
+                                page_size: int = page_size) -> dict:
         """
         Fetch a dict of all the avaliabole sinces (images) in each dataset 
         for a give time amd place. The time and place are class variaboles
@@ -123,6 +433,9 @@ class DownloadEORS(Download):
         _datasets : dict
             dict with information on the dataset to explore. the _dataset
             dict keys are thr datasets names.
+        page_size : int, optional
+            number of scenes to request per scene-search page. The default
+            is page_size from the cfng file.
 
         Returns
         -------
@@ -135,39 +448,84 @@ class DownloadEORS(Download):
         scenes_to_downloads = {}
         for dataset_name, dataset_info in _datasets.items():
             dataset_name = dataset_info['datasetAlias']
-            # Look for data from the last 2 weeks:
-
-            payload = {'datasetName': dataset_name,
-                       'maxResults': 10,
-                       'startingNumber': 1,
-                       'sceneFilter': {'spatialFilter': self.spatial_filter,
-                                       'acquisitionFilter': self.temporal_filter}}
 
             # Now I need to run a scene search to find data to download
             self.logger.info(f'Searching scenes in dataset: {dataset_name}...')
 
-            scenes = self.send_request('scene-search', payload, self.api_key)
+            # Aggregate a list of scene ids
+            scene_ids = [scene['entityId'] for scene in self.iter_scenes(dataset_name, page_size)]
 
-            if scenes['recordsReturned'] <= 0:
-                self.logger.warning(f'Search found no results for {dataset_info["collectionName"]}.\n')
             # Did we find anything?
+            if not scene_ids:
+                self.logger.warning(f'Search found no results for {dataset_info["collectionName"]}.\n')
             else:
-                # Aggregate a list of scene ids
-                scene_ids = [result['entityId'] for result in scenes['results']]
-
+                self.logger.info(f'Found {len(scene_ids)} scenes in dataset: {dataset_name}')
                 # Find the download options for these scenes
-                # NOTE :: Remember the scene list cannot exceed 50,000 items!
-                payload = {'datasetName': dataset_name, 'entityIds': scene_ids}
-
-                download_options = self.send_request('download-options', payload, self.api_key)
-                downloads = [{'entityId': product['entityId'], 'productId': product['id']} for product in
-                             download_options \
-                             if product['available']]
+                downloads = self.get_download_options(dataset_name, scene_ids)
                 if downloads:
                     scenes_to_downloads[dataset_name] = downloads
 
         return scenes_to_downloads
 
+    def request_download(self,
+                         dataset_name,
+                         downloads) -> tuple:
+        """
+        This function inserts the downloads of a dataset into the download
+        queue under a new label
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias of the scenes.
+        downloads : list
+            entityId and productId dict for each scene.
+
+        Returns
+        -------
+        tuple
+            DownloadPoller.add arguments: the label of the download request,
+            used to call download-retrieve, the number of downloads that
+            will become available under it and the downloads that already
+            are.
+
+        """
+        label = f'{dataset_name}-{uuid.uuid4().hex[:8]}'
+        payload = {'downloads': downloads,
+                   'label': label}
+        requested = self.send_request('download-request', payload, self.api_key) or {}
+        count = expected_downloads(label, downloads, requested, self.logger)
+        return label, count, requested.get('availableDownloads') or []
+
+    def iter_download_urls(self,
+                           scenes_to_download):
+        """
+        This function requests the downloads of all the datasets and yields
+        each download url as soon as it is available. All the request labels
+        are polled together by a DownloadPoller.
+
+        Parameters
+        ----------
+        scenes_to_download : dict
+            dict with keys - dataset names
+                      values - a list of entityId and productId dict keys for 
+                      all the avaliabole scines for each dataset 
+
+        Yields
+        ------
+        tuple
+            downloadId and a dict with the download url and entityId.
+
+        """
+        poller = DownloadPoller(self)
+        items = list(scenes_to_download.items())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for request in executor.map(lambda item: self.request_download(*item), items):
+                poller.add(*request)
+        while poller.pending:
+            yield from poller.poll()
+            poller.wait()
+
     def get_download_urls(self,
                           scenes_to_download) -> dict:
         """
@@ -187,46 +545,40 @@ class DownloadEORS(Download):
             avaliabole sence.
 
         """
-        ready_downloads_info = {}
-        for dataset_name, downloads in scenes_to_download.items():
-            requested_downloads_count = len(downloads)
-            # set a label for the download request
-            label = 'download-sample'
-            payload = {'downloads': downloads,
-                       'label': label}
-            # Insert the requested downloads into the download queue and get the available download URLs.
-            request_results = self.send_request('download-request', payload, self.api_key)
-            # PreparingDownloads has a valid link that can be used but data may not be immediately available
-            # Call the download-retrieve method to get download that is available for immediate download
-            payload = {'label': label}
-            ready_downloads = self.send_request('download-retrieve', payload, self.api_key)
-            # Keep record of all the ready to download data
-            for download in ready_downloads['available']:
-                info = {'entityId': download['entityId'],
-                        'url': download['url']}
-                ready_downloads_info[download['downloadId']] = info
-
-            # Didn't get all the requested downloads, wait for 30 sed. and call the download-retrieve method again.
-            while len(ready_downloads_info) < requested_downloads_count:
-                preparing_downloads = requested_downloads_count - len(ready_downloads_info)
-                self.logger.info(f'{preparing_downloads}, downloads are not available. Waiting for 30 seconds.')
-                time.sleep(30)
-                ready_downloads = self.send_request('download-retrieve', payload, self.api_key)
-                for download in ready_downloads['available']:
-                    if download['downloadId'] not in ready_downloads_info:
-                        info = {'entityId': download['entityId'],
-                                'url': download['url']}
-                        ready_downloads_info[download['downloadId']] = info
-            self.logger.info(
-                f'All {requested_downloads_count} downloads from {dataset_name} are available to download.')
-
-        return ready_downloads_info
+        return dict(self.iter_download_urls(scenes_to_download))
+
+    def download_when_ready(self,
+                            scenes_to_download) -> list:
+        """
+        This function requests the downloads and hands each url to the
+        download_files worker pool as soon as it is available, without
+        waiting for the rest of the downloads to be prepared
+
+        Parameters
+        ----------
+        scenes_to_download : dict
+            dict with keys - dataset names
+                      values - a list of entityId and productId dict keys for 
+                      all the avaliabole scines for each dataset 
+
+        Returns
+        -------
+        list
+            download_files result for each file.
+
+        """
+        download_infos = (download_info for _, download_info in self.iter_download_urls(scenes_to_download))
+        results = self.download_scenes(download_infos)
+        self.commit_sync(results)
+        return results
 
     def download_all_to_files(self,
                               download_urls):
         """
-        This function loop through the download URLs and call the
-        download_to_file function
+        This function downloads all the URLs concurrently with the
+        download_files worker pool. Each file is saved as <entityId>.zip
+        unless the server names it. The aggregate throughput is written to
+        the log, and the per-file results are returned.
 
         Parameters
         ----------
@@ -234,20 +586,228 @@ class DownloadEORS(Download):
             dict with downloadId as keys and download url and entityId for each 
             avaliabole sence.
 
+        Returns
+        -------
+        list
+            download_scenes result for each file: url, file_name, size,
+            seconds, error, extracted and entityId.
+
+        """
+        results = self.download_scenes(download_urls.values())
+        self.commit_sync(results)
+        return results
+
+    @staticmethod
+    def dataset_priority(dataset_name) -> int:
+        """
+        This function looks up the [PRIORITY] of a dataset. Names are
+        compared without case or punctuation, so the alias worldview3
+        matches WORLDVIEW-3.
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset name or alias.
+
+        Returns
+        -------
+        int
+            priority, lower is downloaded first. Unlisted datasets get 10.
+        """
+        def normalize(name):
+            return re.sub('[^a-z0-9]', '', name.lower())
+
+        priorities = {normalize(name): priority for name, priority in dataset_priorities.items()}
+        return priorities.get(normalize(dataset_name), DEFAULT_PRIORITY)
+
+    def download_scenes(self, download_infos) -> list:
+        """
+        This function downloads scenes with the download_files worker pool.
+        Each file is saved as <entityId>.zip unless the server names it.
+        Scenes of higher priority datasets are started first.
+
+        Parameters
+        ----------
+        download_infos : iterable
+            dict with the download url and entityId of each scene. It can
+            be a generator, each scene is started as it is taken.
+
+        Returns
+        -------
+        list
+            download_files result for each file, with the scene's entityId.
+
+        """
+        entity_ids = []
+
+        def iter_jobs():
+            for download_info in download_infos:
+                entity_ids.append(download_info['entityId'])
+                dataset_name = self.entity_datasets.get(download_info['entityId'], '')
+                yield (download_info['url'], download_info['entityId'] + ".zip",
+                       self.dataset_priority(dataset_name))
+
+        results = self.download_files(iter_jobs())
+        for entity_id, result in zip(entity_ids, results):
+            result['entityId'] = entity_id
+        return results
+
+    def commit_sync(self, results):
+        """
+        This function records the downloaded scenes in the sync state, and
+        the search window of every searched dataset with no failed download
+
+        Parameters
+        ----------
+        results : list
+            download_scenes result for each file.
+
         Returns
         -------
         None.
 
         """
-        file_name: str
-        for download_info in download_urls.values():
-            url = download_info['url']
-            file_name = download_info['entityId'] + ".zip"
-            _ = self.download_to_file(url, file_name)
-            
+        if self.state is None:
+            return
+        fetched = {}
+        failed_datasets = set()
+        for result in results:
+            dataset_name = self.entity_datasets.get(result['entityId'])
+            if result['error'] is None:
+                fetched.setdefault(dataset_name, []).append(result['entityId'])
+            else:
+                failed_datasets.add(dataset_name)
+        for dataset_name, entity_ids in fetched.items():
+            if dataset_name is not None:
+                self.state.add_entities(self.aoi, dataset_name, entity_ids)
+        for dataset_name in self.searched_datasets - failed_datasets:
+            acquisition_filter = self.acquisition_filter(dataset_name)
+            self.state.set_window(self.aoi, dataset_name,
+                                  acquisition_filter['start'], acquisition_filter['end'])
+        self.searched_datasets.clear()
+
+    def run_pipeline(self, queue_size: int = queue_size) -> list:
+        """
+        This function runs search, download-request, download-retrieve and
+        download as concurrent stages connected by bounded queues. Scenes flow
+        to the next stage one scene-search page at a time, so the first files
+        are downloaded while later datasets are still searched and later
+        download requests are still prepared.
+
+        Parameters
+        ----------
+        queue_size : int, optional
+            max number of items waiting between two stages. The default is
+            queue_size from the [PIPELINE] section of the cfng file.
+
+        Returns
+        -------
+        list
+            download_files result for each file.
+
+        """
+        orders = queue.Queue(maxsize=queue_size)
+        labels = queue.Queue(maxsize=queue_size)
+        jobs = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        def get(q, block=True):
+            while not stop.is_set():
+                try:
+                    return q.get(block=block, timeout=1 if block else None)
+                except queue.Empty:
+                    if not block:
+                        raise
+            return _DONE
+
+        def search_dataset(dataset):
+            datasets = self._search_dataset(dataset)
+            if not datasets:
+                return
+            dataset_name = datasets[0]['datasetAlias']
+            scene_ids = []
+            for scene in self.iter_scenes(dataset_name):
+                scene_ids.append(scene['entityId'])
+                if len(scene_ids) == page_size:
+                    put(orders, (dataset_name, self.get_download_options(dataset_name, scene_ids)))
+                    scene_ids = []
+            if scene_ids:
+                put(orders, (dataset_name, self.get_download_options(dataset_name, scene_ids)))
+
+        def search():
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(search_dataset, self.dataset_names))
+
+        def order():
+            item = get(orders)
+            while item is not _DONE:
+                dataset_name, downloads = item
+                if downloads:
+                    put(labels, self.request_download(dataset_name, downloads))
+                item = get(orders)
+
+        def retrieve():
+            poller = DownloadPoller(self)
+            ordering = True
+            while (ordering or poller.pending) and not stop.is_set():
+                # Block for new labels only when there is nothing to poll
+                block = not poller.pending
+                try:
+                    while True:
+                        item = get(labels, block)
+                        block = False
+                        if item is _DONE:
+                            ordering = False
+                            break
+                        poller.add(*item)
+                except queue.Empty:
+                    pass
+                for _, download_info in poller.poll():
+                    put(jobs, download_info)
+                poller.wait(timeout=1)
+
+        def stage(func, output):
+            try:
+                func()
+            except BaseException:
+                stop.set()
+                raise
+            finally:
+                put(output, _DONE)
+
+        def iter_download_infos():
+            download_info = get(jobs)
+            while download_info is not _DONE:
+                yield download_info
+                download_info = get(jobs)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            stages = [executor.submit(stage, search, orders),
+                      executor.submit(stage, order, labels),
+                      executor.submit(stage, retrieve, jobs)]
+            try:
+                results = self.download_scenes(iter_download_infos())
+            except BaseException:
+                stop.set()
+                raise
+            for future in stages:
+                future.result()
+        self.commit_sync(results)
+        return results
+
     def close_api(self):
         """
-        This function close the connection to the API
+        This function logs out of the API and closes the pooled HTTP session.
+        With the API key cache the key stays valid for the next runs, so
+        there is no logout.
 
         Returns
         -------
@@ -255,8 +815,15 @@ class DownloadEORS(Download):
 
         """
         endpoint = 'logout'
-        if self.send_request(endpoint, {}, self.api_key) is None:
+        if self.api_key_cache is not None:
+            self.logger.info('Keeping the cached API key\n\n')
+        elif self.send_request(endpoint, {}, self.api_key) is None:
             self.logger.info('Logged Out\n\n')
         else:
             self.logger.warning('Logout Failed\n\n')
+        if self.state is not None:
+            self.state.close()
+        if self.cache is not None:
+            self.cache.close()
+        self.close()
         
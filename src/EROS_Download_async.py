@@ -0,0 +1,596 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from urllib.parse import urlparse
+
+import aiohttp
+from dotenv import load_dotenv
+
+from config import (DATA_PATH, service_url, dataset_names, kml_file, pool_size, max_workers,
+                    connect_timeout, read_timeout, footprint_filter,
+                    page_size, options_batch_size, download_workers, host_workers,
+                    poll_interval, poll_max_interval, poll_backoff, poll_jitter, poll_timeout, retry_attempts,
+                    rate_limits, rate_limit_path, api_key_path, api_key_ttl)
+from cache import ApiKeyCache
+from download import DownloadBase
+from EROS_Download import MAX_ENTITY_IDS
+from geometry import FootprintFilter, make_spatial_filter
+from kml import KMLPolygons
+from poller import expected_downloads, ready_download
+from errors import (AuthError, EROSError, IntegrityError, RateLimitError, TransientError,
+                    parse_retry_after, raise_for_response, retry_delay)
+from integrity import expected_digests, hash_file, new_hashes
+from ratelimit import RateLimiter
+
+
+class AsyncDownloadEORS(DownloadBase):
+    """
+    asyncio counterpart of DownloadEORS built on aiohttp. All the API calls
+    and downloads are coroutines, so one event loop can drive many of them
+    at once. File writes, hashing and verification run in worker threads,
+    so they never block the loop. Create it with:
+
+        dl = await AsyncDownloadEORS.create(date_range=14)
+    """
+
+    def __init__(self,
+                 date_range: int = 14,
+                 pool_size: int = pool_size,
+                 service_url: str = service_url,
+                 max_in_flight: int = max_workers,
+                 api_key_path: str = api_key_path):
+        super().__init__(date_range, 'EROS_async')
+        self.pool_size = pool_size
+        load_dotenv()
+        self.username = os.getenv('EROS_user')
+        self.password = os.getenv('EROS_password')
+        self.service_url = service_url
+        polygons = KMLPolygons.read(kml_file)
+        self.spatial_filter = make_spatial_filter(polygons)
+        self.footprint = FootprintFilter(polygons) if footprint_filter else None
+        self.temporal_filter = dict(start=self.start, end=self.end)
+        self.dataset_names = dataset_names
+        self.api_slots = asyncio.Semaphore(max_in_flight)
+        self.rate_limiter = RateLimiter(rate_limits, rate_limit_path)
+        self.api_key_cache = ApiKeyCache(api_key_path, api_key_ttl) if api_key_path else None
+        self.login_lock = asyncio.Lock()
+        self.http = None
+        self.api_key = None
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        This function creates the client and logs into the API
+
+        Returns
+        -------
+        AsyncDownloadEORS
+            logged in client.
+        """
+        self = cls(*args, **kwargs)
+        # the default total=300 would abort any download longer than 5 minutes
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.http = aiohttp.ClientSession(timeout=timeout,
+                                          connector=aiohttp.TCPConnector(limit=self.pool_size))
+        try:
+            self.api_key = await self.login()
+        except BaseException:
+            await self.http.close()
+            raise
+        return self
+
+    async def login(self, expired_key=None) -> str:
+        """
+        This function logs into the API. With the API key cache, a cached key
+        that has not expired is reused instead.
+
+        Parameters
+        ----------
+        expired_key : str, optional
+            a key the server rejected, so it is not reused. The default is None.
+
+        Returns
+        -------
+        str
+            API key.
+
+        """
+        async def login():
+            self.logger.info(f'Logging into {self.service_url}')
+            payload = {'username': self.username, 'password': self.password}
+            return await self.send_request('login', payload)
+
+        if self.api_key_cache is None:
+            return await login()
+        # the cache blocks on a lock file shared with other processes, so it
+        # runs in a thread and sends the login back to this loop
+        loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(self.api_key_cache.get_or_login, self.service_url, self.username,
+                                       lambda: asyncio.run_coroutine_threadsafe(login(), loop).result(),
+                                       expired_key)
+
+    async def refresh_api_key(self, expired_key) -> str:
+        """
+        This function replaces an API key the server rejected. Coroutines
+        that hit the same rejected key share one new login.
+
+        Parameters
+        ----------
+        expired_key : str
+            the rejected key.
+
+        Returns
+        -------
+        str
+            new API key.
+
+        """
+        async with self.login_lock:
+            if self.api_key == expired_key:
+                self.logger.info('API key was rejected, logging in again')
+                self.api_key = await self.login(expired_key)
+        return self.api_key
+
+    async def _post(self, url, json_data, api_key):
+        headers = {} if api_key is None else {'X-Auth-Token': api_key}
+        try:
+            async with self.http.post(url, data=json_data, headers=headers) as response:
+                text = await response.text()
+                status_code = response.status
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransientError(f'Failed to fetch remote {url} info ({e})') from e
+        try:
+            output = json.loads(text)
+        except ValueError:
+            output = None
+        raise_for_response(url, status_code, output, retry_after)
+        return output['data']
+
+    async def send_request(self,
+                           request,
+                           data,
+                           api_key=None,
+                           attempts: int = retry_attempts):
+        """
+        This function handles the comunication with the API server. At most
+        max_in_flight requests are sent at once, within the endpoint's
+        rate-limit budget. Rate-limit, server and network errors are retried
+        with exponential backoff (or after the server's Retry-After). A
+        request rejected for an expired API key is sent again once with a
+        new key.
+
+        Parameters
+        ----------
+        request : str
+            The request type from the database see here: https://m2m.cr.usgs.gov/api/docs/json/.
+        data : dict
+            payload - used as time and location filter.
+        api_key : str, optional
+            API key to comunicate with the API. The default is None.
+        attempts : int, optional
+            max number of attempts. The default is attempts from the
+            [RETRY] section of the cfng file.
+
+        Raises
+        ------
+        RateLimitError, TransientError
+            the request still failed after all the attempts.
+        APIError
+            the API rejected the request.
+
+        Returns
+        -------
+        dict or str (when loggin - API key)
+            Requested data.
+
+        """
+        json_data = json.dumps(data)
+        url = self.service_url + request
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                await asyncio.sleep(self.rate_limiter.reserve(request))
+                async with self.api_slots:
+                    return await self._post(url, json_data, api_key)
+            except AuthError as e:
+                if api_key is None or request == 'logout' or refreshed:
+                    self.logger.warning(str(e))
+                    raise
+                refreshed = True
+                api_key = await self.refresh_api_key(api_key)
+            except (RateLimitError, TransientError) as e:
+                attempt += 1
+                if attempt >= attempts:
+                    self.logger.warning(f'{e} (gave up after {attempt} attempts)')
+                    raise
+                delay = retry_delay(attempt, e)
+                self.logger.warning(f'{e}. Retrying in {delay:.1f} seconds')
+                await asyncio.sleep(delay)
+            except EROSError as e:
+                self.logger.warning(str(e))
+                raise
+
+    async def _search_dataset(self, dataset) -> list:
+        payload = {'datasetName': dataset,
+                   'spatialFilter': self.spatial_filter,
+                   'temporalFilter': self.temporal_filter}
+        self.logger.info(f'Searching dataset name: {dataset}...')
+        return await self.send_request('dataset-search', payload, self.api_key)
+
+    async def get_available_datasets(self) -> dict:
+        """
+        This function fetch the datasets with avaliabole data for time
+        and place. All the dataset searches are sent at once.
+
+        Returns
+        -------
+        dict
+            Return a dict with information on each dataset.
+            The dict keys are the dataset's name .
+
+        """
+        results = await asyncio.gather(*(self._search_dataset(dataset)
+                                         for dataset in self.dataset_names))
+        _datasets = {}
+        for dataset, dataset_data in zip(self.dataset_names, results):
+            self.logger.info(f'Found {len(dataset_data)} datasets for {dataset}')
+            if len(dataset_data):
+                _datasets[dataset] = dataset_data[0]
+        return _datasets
+
+    async def iter_scenes(self,
+                          dataset_name,
+                          page_size: int = page_size):
+        """
+        This function pages through the scene-search results of a dataset
+        for time and place, following nextRecord until totalHits are fetched.
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias to search.
+        page_size : int, optional
+            number of scenes to request per page. The default is page_size
+            from the cfng file.
+
+        Yields
+        ------
+        dict
+            scene-search result for each scene.
+
+        """
+        starting_number = 1
+        while True:
+            payload = {'datasetName': dataset_name,
+                       'maxResults': page_size,
+                       'startingNumber': starting_number,
+                       'sceneFilter': {'spatialFilter': self.spatial_filter,
+                                       'acquisitionFilter': self.temporal_filter}}
+            scenes = await self.send_request('scene-search', payload, self.api_key)
+            results = scenes['results']
+            if self.footprint is not None:
+                results = self.footprint.filter(results)
+            for scene in results:
+                yield scene
+
+            next_record = scenes.get('nextRecord')
+            records_returned = scenes['recordsReturned']
+            if (records_returned <= 0
+                    or starting_number + records_returned > scenes['totalHits']
+                    or not next_record
+                    or next_record <= starting_number):
+                break
+            starting_number = next_record
+
+    async def get_download_options(self,
+                                   dataset_name,
+                                   scene_ids,
+                                   batch_size: int = options_batch_size) -> list:
+        """
+        This function fetch the download options for a list of scenes in
+        concurrent batches of at most MAX_ENTITY_IDS
+
+        Parameters
+        ----------
+        dataset_name : str
+            dataset alias of the scenes.
+        scene_ids : list
+            entityId of each scene.
+        batch_size : int, optional
+            number of entityIds per download-options call. The default is
+            options_batch_size from the cfng file.
+
+        Returns
+        -------
+        list
+            entityId and productId dict for each available product.
+
+        """
+        batch_size = max(1, min(batch_size, MAX_ENTITY_IDS))
+        batches = [scene_ids[i: i + batch_size] for i in range(0, len(scene_ids), batch_size)]
+        results = await asyncio.gather(*(self.send_request('download-options',
+                                                           {'datasetName': dataset_name, 'entityIds': batch},
+                                                           self.api_key)
+                                         for batch in batches))
+        return [{'entityId': product['entityId'], 'productId': product['id']}
+                for download_options in results
+                for product in download_options or []
+                if product['available']]
+
+    async def _get_scenes_for_dataset(self, dataset_info) -> tuple:
+        dataset_name = dataset_info['datasetAlias']
+        self.logger.info(f'Searching scenes in dataset: {dataset_name}...')
+        scene_ids = [scene['entityId'] async for scene in self.iter_scenes(dataset_name)]
+        if not scene_ids:
+            self.logger.warning(f'Search found no results for {dataset_info["collectionName"]}.\n')
+            return dataset_name, []
+        self.logger.info(f'Found {len(scene_ids)} scenes in dataset: {dataset_name}')
+        return dataset_name, await self.get_download_options(dataset_name, scene_ids)
+
+    async def get_scenes_for_datasets(self,
+                                      _datasets) -> dict:
+        """
+        Fetch a dict of all the avaliabole sinces (images) in each dataset
+        for a give time amd place. The datasets are searched concurrently.
+
+        Parameters
+        ----------
+        _datasets : dict
+            dict with information on the dataset to explore. the _dataset
+            dict keys are thr datasets names.
+
+        Returns
+        -------
+        dict
+            dict with keys - dataset names
+                      values - a list of entityId and productId dict keys for
+                      all the avaliabole scines for each dataset
+
+        """
+        results = await asyncio.gather(*(self._get_scenes_for_dataset(dataset_info)
+                                         for dataset_info in _datasets.values()))
+        return {dataset_name: downloads for dataset_name, downloads in results if downloads}
+
+    async def _retrieve_downloads(self, dataset_name, downloads) -> dict:
+        label = f'{dataset_name}-{uuid.uuid4().hex[:8]}'
+        payload = {'downloads': downloads,
+                   'label': label}
+        requested = await self.send_request('download-request', payload, self.api_key) or {}
+        count = expected_downloads(label, downloads, requested, self.logger)
+
+        available = requested.get('availableDownloads') or []
+        ready_downloads_info = dict(ready for ready in map(ready_download, available) if ready is not None)
+        interval = poll_interval
+        deadline = time.monotonic() + poll_timeout
+        while len(ready_downloads_info) < count:
+            ready_downloads = await self.send_request('download-retrieve', {'label': label}, self.api_key)
+            new_downloads = [ready for ready in map(ready_download, ready_downloads['available'])
+                             if ready is not None and ready[0] not in ready_downloads_info]
+            ready_downloads_info.update(new_downloads)
+            preparing_downloads = count - len(ready_downloads_info)
+            if preparing_downloads <= 0:
+                break
+            if time.monotonic() >= deadline:
+                self.logger.warning(f'{preparing_downloads} downloads from {label} are still not '
+                                    f'available after {poll_timeout:.0f} seconds, giving up on them.')
+                return ready_downloads_info
+            if new_downloads:
+                interval = poll_interval
+            else:
+                interval = min(interval * poll_backoff, poll_max_interval)
+            delay = interval * random.uniform(1 - poll_jitter, 1 + poll_jitter)
+            self.logger.info(f'{preparing_downloads} downloads from {label} are not available. '
+                             f'Polling again in {delay:.0f} seconds.')
+            await asyncio.sleep(delay)
+        self.logger.info(f'All {count} downloads from {label} are available to download.')
+        return ready_downloads_info
+
+    async def get_download_urls(self,
+                                scenes_to_download) -> dict:
+        """
+        This function fetch the download url for each sence. The labels of
+        all the datasets are polled concurrently with adaptive backoff.
+
+        Parameters
+        ----------
+        scenes_to_download : dict
+            dict with keys - dataset names
+                      values - a list of entityId and productId dict keys for
+                      all the avaliabole scines for each dataset
+
+        Returns
+        -------
+        dict
+            dict with downloadId as keys and download url and entityId for each
+            avaliabole sence.
+
+        """
+        results = await asyncio.gather(*(self._retrieve_downloads(dataset_name, downloads)
+                                         for dataset_name, downloads in scenes_to_download.items()))
+        return {download_id: info for ready_downloads_info in results
+                for download_id, info in ready_downloads_info.items()}
+
+    async def download_to_file(self, download_url, file_name) -> str:
+        """
+        This function download data from a URL and saves it as a zip file.
+        Files already in DATA_PATH are skipped without a request. The data is
+        written to <file_name>.part and renamed once complete, so an
+        interrupted download is resumed with a Range request. A file that
+        fails verification is downloaded again.
+
+        Parameters
+        ----------
+        download_url : str
+            url to download the data.
+        file_name : str
+            file name to save the data. Replaced by the name in the
+            Content-Disposition header when the server sends one.
+
+        Returns
+        -------
+        str
+            path to the saved data.
+        """
+        for attempt in range(self.redownloads + 1):
+            try:
+                return await self._download_to_file(download_url, file_name)
+            except IntegrityError as e:
+                if attempt == self.redownloads:
+                    raise
+                self.logger.warning(f'{e}, downloading it again')
+
+    async def _download_to_file(self, download_url, file_name):
+        if file_name in self.present_files:
+            return os.path.join(DATA_PATH, self.saved_name(file_name))
+
+        requested = file_name
+        part_name = os.path.join(DATA_PATH, file_name + '.part')
+        offset, headers = self.resume_headers(part_name)
+        r = await self.http.get(download_url, headers=headers)
+        if r.status == 416:
+            # The .part file is at least as long as the file, start over
+            r.release()
+            offset = 0
+            r = await self.http.get(download_url)
+        async with r:
+            r.raise_for_status()
+            if offset and not (r.status == 206 and
+                               r.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                offset = 0
+            if r.status == 206:
+                size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+            else:
+                size = r.content_length
+            try:
+                filename = r.headers['Content-Disposition']
+                file_name = filename.replace('"', '').split('=')[1]
+            except KeyError:
+                pass
+            if file_name in self.present_files:
+                return os.path.join(DATA_PATH, file_name)
+            expected = expected_digests(r.headers) if r.status == 200 else {}
+            hashes = new_hashes(self.checksums)
+
+            def open_part():
+                if offset:
+                    hash_file(part_name, hashes, offset, self.chunk_size)
+                else:
+                    self.save_validator(part_name, r.headers)
+                return self.open_part(part_name, offset, size)
+
+            def close_part():
+                # the length of the .part file is where the next run resumes
+                f.truncate()
+                f.close()
+
+            f = await asyncio.to_thread(open_part)
+            try:
+                async for chunk in r.content.iter_chunked(self.chunk_size):
+                    await asyncio.to_thread(self.write_chunk, f, chunk, hashes)
+                    delay = self.throttle_delay(len(chunk))
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+            finally:
+                await asyncio.to_thread(close_part)
+
+        return await asyncio.to_thread(self.finish_download, part_name, file_name, size, hashes, expected,
+                                       requested)
+
+    async def download_all_to_files(self,
+                                    download_urls,
+                                    max_workers: int = download_workers,
+                                    max_per_host: int = host_workers):
+        """
+        This function downloads all the URLs concurrently. Each file is saved
+        as <entityId>.zip unless the server names it. With [EXTRACT] enabled,
+        each zip file is extracted as soon as it is downloaded. The aggregate
+        throughput is written to the log, and the per-file results are
+        returned.
+
+        Parameters
+        ----------
+        download_urls : dict
+            dict with downloadId as keys and download url and entityId for each
+            avaliabole sence.
+        max_workers : int, optional
+            max number of downloads in flight overall. The default is
+            max_workers from the [DOWNLOAD] section of the cfng file.
+        max_per_host : int, optional
+            max number of downloads in flight from the same host. The
+            default is max_per_host from the [DOWNLOAD] section.
+
+        Returns
+        -------
+        list
+            dict for each file with url, file_name (path of the saved data),
+            size (bytes), seconds, error (None on success), extracted
+            (extraction folder, None when not extracted) and entityId, as
+            returned by the sync client.
+
+        """
+        slots = asyncio.Semaphore(max_workers)
+        host_slots = {}
+
+        async def download(download_url, entity_id):
+            host_slot = host_slots.setdefault(urlparse(download_url).netloc,
+                                              asyncio.Semaphore(max_per_host))
+            result = {'url': download_url, 'file_name': entity_id + '.zip', 'size': 0, 'seconds': 0.0,
+                      'error': None, 'extracted': None, 'entityId': entity_id}
+            async with slots, host_slot:
+                start = time.perf_counter()
+                try:
+                    result['file_name'] = await self.download_to_file(download_url, result['file_name'])
+                    if os.path.exists(result['file_name']):
+                        # else it was extracted and deleted by an earlier run
+                        result['size'] = os.path.getsize(result['file_name'])
+                except Exception as e:
+                    result['error'] = e
+                    self.logger.warning(f'Failed to download {download_url} ({e})')
+                result['seconds'] = time.perf_counter() - start
+            if (self.extractor is not None and result['error'] is None
+                    and result['file_name'].lower().endswith('.zip')
+                    and os.path.exists(result['file_name'])):
+                try:
+                    result['extracted'] = await asyncio.wrap_future(self.extractor.submit(result['file_name']))
+                except Exception as e:
+                    self.logger.warning(f'Failed to extract {result["file_name"]} ({e})')
+            return result
+
+        start = time.perf_counter()
+        # lists DATA_PATH and reads the manifest once, off the event loop
+        await asyncio.to_thread(getattr, self, 'present_files')
+        results = await asyncio.gather(*(download(download_info['url'], download_info['entityId'])
+                                         for download_info in download_urls.values()))
+        elapsed = time.perf_counter() - start
+        total_size = sum(result['size'] for result in results)
+        failed = sum(result['error'] is not None for result in results)
+        self.logger.info(f'Downloaded {len(results) - failed}/{len(results)} files, '
+                         f'{total_size / 1e6:.1f} MB in {elapsed:.1f} s '
+                         f'({total_size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)')
+        return results
+
+    async def close_api(self):
+        """
+        This function logs out of the API and closes the HTTP sessions.
+        With the API key cache the key stays valid for the next runs, so
+        there is no logout.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.api_key_cache is not None:
+            self.logger.info('Keeping the cached API key\n\n')
+        elif await self.send_request('logout', {}, self.api_key) is None:
+            self.logger.info('Logged Out\n\n')
+        else:
+            self.logger.warning('Logout Failed\n\n')
+        await self.http.close()
+        # waits for the queued extractions
+        await asyncio.to_thread(self.close)
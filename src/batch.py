@@ -0,0 +1,201 @@
+"""
+Downloads the scenes of many areas of interest in one run, on one API
+session. A scene that covers several areas is ordered and downloaded once.
+
+Run from the src folder with a folder of KML files, or a KML file with one
+placemark per area, e.g.:
+
+    python batch.py avalanche_paths/
+    python batch.py AvalanchePaths.kml --date-range 7
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config import max_workers, page_size
+from EROS_Download import DownloadEORS
+from kml import KMLPolygons
+
+
+def load_aois(path) -> list:
+    """
+    This function reads the areas of interest of a batch
+
+    Parameters
+    ----------
+    path : str
+        folder of KML files, one area per file, or a KML file with one area
+        per placemark.
+
+    Returns
+    -------
+    list
+        (aoi, polygons) for each area. aoi names the area in the sync
+        state: the KML path, with #<placemark name> when the file holds
+        several areas. polygons is a kml.KMLPolygons.
+    """
+    if os.path.isdir(path):
+        return [(kml_file, KMLPolygons.read(kml_file))
+                for kml_file in sorted(glob.glob(os.path.join(path, '*.kml')))]
+    polygons = KMLPolygons.read(path)
+    if len(polygons.names) == 1:
+        return [(path, polygons)]
+    return [(f'{path}#{name or i}', polygons.placemark(i))
+            for i, name in enumerate(polygons.names)]
+
+
+class BatchDownloadEORS:
+    """
+    Searches many areas of interest concurrently with one DownloadEORS
+    client, and orders each scene once however many areas it covers
+
+    Parameters
+    ----------
+    aois : list
+        (aoi, polygons) for each area, see load_aois.
+    **kwargs
+        DownloadEORS arguments.
+    """
+
+    def __init__(self, aois, **kwargs):
+        self.client = DownloadEORS(**kwargs)
+        self.logger = self.client.logger
+        self.clients = [self.client.with_aoi(*aoi) for aoi in aois]
+
+    def search(self, max_workers: int = max_workers, page_size: int = page_size) -> dict:
+        """
+        This function runs the dataset and scene searches of every area and
+        dataset concurrently
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            max number of searches in flight at once. The default is
+            max_workers from the cfng file.
+        page_size : int, optional
+            number of scenes to request per scene-search page. The default
+            is page_size from the cfng file.
+
+        Returns
+        -------
+        dict
+            dict with keys - (area index, dataset alias)
+                      values - entityId list of the scenes found.
+        """
+        def search_dataset(job):
+            index, dataset = job
+            client = self.clients[index]
+            datasets = client._search_dataset(dataset)
+            if not datasets:
+                return None, []
+            dataset_name = datasets[0]['datasetAlias']
+            return dataset_name, [scene['entityId'] for scene in client.iter_scenes(dataset_name, page_size)]
+
+        jobs = [(index, dataset) for index in range(len(self.clients))
+                for dataset in self.client.dataset_names]
+        found = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (index, _), (dataset_name, scene_ids) in zip(jobs, executor.map(search_dataset, jobs)):
+                if scene_ids:
+                    found.setdefault((index, dataset_name), []).extend(scene_ids)
+        return found
+
+    def get_scenes_for_datasets(self, found) -> dict:
+        """
+        This function deduplicates the scenes found for all the areas and
+        fetches the download options of each scene once. A scene is
+        assigned to the first area that has not downloaded it yet, and
+        dropped when every area has.
+
+        Parameters
+        ----------
+        found : dict
+            search result.
+
+        Returns
+        -------
+        dict
+            dict with keys - dataset names
+                      values - a list of entityId and productId dict keys for
+                      all the avaliabole scines for each dataset
+        """
+        assigned = {}
+        for (index, dataset_name), scene_ids in found.items():
+            client = self.clients[index]
+            known_entities = set()
+            if client.state is not None:
+                known_entities = client.state.known_entities(client.aoi, dataset_name)
+            for scene_id in scene_ids:
+                if scene_id not in known_entities:
+                    assigned.setdefault((dataset_name, scene_id), index)
+        total = sum(len(scene_ids) for scene_ids in found.values())
+        self.logger.info(f'Found {total} scenes in {len(self.clients)} areas, '
+                         f'{len(assigned)} new unique scenes')
+
+        batches = {}
+        for (dataset_name, scene_id), index in assigned.items():
+            batches.setdefault((index, dataset_name), []).append(scene_id)
+        scenes_to_download = {}
+        for (index, dataset_name), scene_ids in batches.items():
+            downloads = self.clients[index].get_download_options(dataset_name, scene_ids)
+            scenes_to_download.setdefault(dataset_name, []).extend(downloads)
+        return scenes_to_download
+
+    def commit_sync(self, found, results):
+        """
+        This function records the downloaded scenes in the sync state of
+        every area they cover
+
+        Parameters
+        ----------
+        found : dict
+            search result.
+        results : list
+            download_scenes result for each file.
+
+        Returns
+        -------
+        None.
+        """
+        for index, client in enumerate(self.clients):
+            entity_ids = {scene_id for (i, _), scene_ids in found.items() if i == index
+                          for scene_id in scene_ids}
+            client.commit_sync([result for result in results if result['entityId'] in entity_ids])
+
+    def run(self) -> list:
+        """
+        This function searches all the areas, orders the new scenes once
+        and downloads each file as soon as it is ready
+
+        Returns
+        -------
+        list
+            download_files result for each file.
+        """
+        found = self.search()
+        scenes_to_download = self.get_scenes_for_datasets(found)
+        download_infos = (download_info for _, download_info
+                          in self.client.iter_download_urls(scenes_to_download))
+        results = self.client.download_scenes(download_infos)
+        self.commit_sync(found, results)
+        return results
+
+    def close_api(self):
+        """
+        This function logs out of the API and closes the shared session
+        """
+        self.client.close_api()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('aois', help='folder of KML files or a multi-placemark KML file')
+    arg_parser.add_argument('--date-range', type=int, default=14, help='days to search back')
+    args = arg_parser.parse_args()
+
+    batch = BatchDownloadEORS(load_aois(args.aois), date_range=args.date_range)
+    batch.run()
+    batch.close_api()
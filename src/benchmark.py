@@ -0,0 +1,342 @@
+"""
+Benchmarks for the EROS download module. Each benchmark runs against a
+local mock server, so no Earth Explorer account or network is needed.
+
+Run from the src folder, e.g.:
+
+    python benchmark.py options --scenes 50000
+    python benchmark.py segments --size 200
+    python benchmark.py chunks --size 500
+    python benchmark.py kml --placemarks 2000 --vertices 50
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import re
+import resource
+import threading
+import time
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from pykml import parser
+
+from config import DATA_PATH
+from download import Download
+from EROS_Download import DownloadEORS, MAX_ENTITY_IDS
+from kml import KML_NS, KMLPolygons
+from ratelimit import RateLimiter
+
+
+class MockM2MHandler(BaseHTTPRequestHandler):
+    """
+    Minimal M2M API. Each call costs a fixed latency plus a small cost
+    per entityId, like a real server parsing and looking up the scenes.
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.05
+    per_entity = 2e-6
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_POST(self):
+        endpoint = self.path.rsplit('/', 1)[-1]
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        output = {'errorCode': None, 'errorMessage': None, 'data': None}
+        if endpoint == 'login':
+            output['data'] = 'mock-api-key'
+        elif endpoint == 'download-options':
+            entity_ids = payload['entityIds']
+            time.sleep(self.latency + self.per_entity * len(entity_ids))
+            if len(entity_ids) > MAX_ENTITY_IDS:
+                output['errorCode'] = 'INPUT_LIMIT'
+                output['errorMessage'] = f'entityIds cannot exceed {MAX_ENTITY_IDS} items'
+            else:
+                output['data'] = [{'entityId': entity_id,
+                                   'id': f'product-{entity_id}',
+                                   'available': True} for entity_id in entity_ids]
+        self.send_body(json.dumps(output).encode(), headers=[('Content-Type', 'application/json')])
+
+
+class MockFileHandler(MockM2MHandler):
+    """
+    Serves an in-memory file with Range support. Each connection is capped
+    at rate bytes/s, like a long-haul TCP stream.
+    """
+    data = b''
+    rate = 25e6
+    chunk_size = 1 << 16
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # the client closed a stream it had read enough of
+            pass
+
+    def do_GET(self):
+        headers = [('Accept-Ranges', 'bytes'), ('Content-Type', 'application/zip')]
+        first, last = 0, len(self.data) - 1
+        status = 200
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else last
+            if first >= len(self.data):
+                self.send_body(b'', 416, [('Content-Range', f'bytes */{len(self.data)}')])
+                return
+            status = 206
+            headers.append(('Content-Range', f'bytes {first}-{last}/{len(self.data)}'))
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        start = time.perf_counter()
+        for offset in range(first, last + 1, self.chunk_size):
+            chunk = self.data[offset: min(offset + self.chunk_size, last + 1)]
+            self.wfile.write(chunk)
+            sent = offset + len(chunk) - first
+            delay = sent / self.rate - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    do_HEAD = do_GET
+
+
+def make_zip(size) -> bytes:
+    """
+    This function makes an uncompressed zip file of about size bytes with
+    one random member, so downloads pass the zip validation
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr('scene.tif', os.urandom(size))
+    return buffer.getvalue()
+
+
+def start_server(handler) -> ThreadingHTTPServer:
+    """
+    This function starts a mock server on a free local port in a
+    background thread
+
+    Parameters
+    ----------
+    handler : BaseHTTPRequestHandler
+        request handler class.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        the running server. Call shutdown() when done.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_file(size, ports):
+    """
+    This function serves a random file of size bytes without a rate cap
+    until the process is terminated. The port is put on the ports queue.
+    """
+    MockFileHandler.data = make_zip(size)
+    MockFileHandler.rate = float('inf')
+    MockFileHandler.chunk_size = 1 << 20
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockFileHandler)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def bench_download_options(n_scenes, batch_sizes, max_workers):
+    """
+    This function measures download-options throughput (entities/s) for
+    different batch sizes. The client has no [RATE_LIMIT] budgets, so the
+    batch size is measured rather than the limiter.
+    """
+    server = start_server(MockM2MHandler)
+    dl = DownloadEORS(service_url=f'http://127.0.0.1:{server.server_port}/api/', api_key_path='')
+    dl.rate_limiter = RateLimiter({})
+    scene_ids = [f'SCENE{i:07d}' for i in range(n_scenes)]
+    print(f'download-options: {n_scenes} scenes, {max_workers} workers, no rate limit')
+    print(f'{"batch size":>10} {"calls":>6} {"seconds":>8} {"entities/s":>11}')
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        downloads = dl.get_download_options('mock', scene_ids,
+                                            batch_size=batch_size,
+                                            max_workers=max_workers)
+        elapsed = time.perf_counter() - start
+        assert len(downloads) == n_scenes
+        calls = -(-n_scenes // min(batch_size, MAX_ENTITY_IDS))
+        print(f'{batch_size:>10} {calls:>6} {elapsed:>8.2f} {n_scenes / elapsed:>11,.0f}')
+    dl.close()
+    server.shutdown()
+
+
+def bench_segments(size_mb, segment_counts, rate_mb):
+    """
+    This function measures single-file download speed (MB/s) for different
+    numbers of segments against a server that caps each connection
+    """
+    MockFileHandler.data = make_zip(size_mb << 20)
+    MockFileHandler.rate = rate_mb * 1e6
+    server = start_server(MockFileHandler)
+    os.makedirs(DATA_PATH, exist_ok=True)
+    dl = Download(log_mame='benchmark')
+    url = f'http://127.0.0.1:{server.server_port}/scene.zip'
+    print(f'segmented download: {size_mb} MiB file, {rate_mb} MB/s per connection')
+    print(f'{"segments":>8} {"seconds":>8} {"MB/s":>8}')
+    for n in segment_counts:
+        file_name = f'benchmark_{n}.zip'
+        start = time.perf_counter()
+        path = dl.download_to_file(url, file_name, segments=n)
+        elapsed = time.perf_counter() - start
+        assert os.path.getsize(path) == len(MockFileHandler.data)
+        os.remove(path)
+        print(f'{n:>8} {elapsed:>8.2f} {len(MockFileHandler.data) / 1e6 / elapsed:>8.1f}')
+    dl.close()
+    server.shutdown()
+
+
+def bench_chunks(size_mb, chunk_sizes):
+    """
+    This function measures single-stream download speed (MB/s) and client
+    CPU time per GB for different chunk sizes. The server runs in its own
+    process, so its CPU time is not counted.
+    """
+    size = size_mb << 20
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_file, args=(size, ports), daemon=True)
+    server.start()
+    url = f'http://127.0.0.1:{ports.get()}/scene.zip'
+    os.makedirs(DATA_PATH, exist_ok=True)
+    dl = Download(log_mame='benchmark')
+    print(f'chunked download: {size_mb} MiB file')
+    print(f'{"chunk size":>10} {"seconds":>8} {"MB/s":>8} {"CPU s/GB":>9}')
+    for chunk_size in chunk_sizes:
+        dl.chunk_size = chunk_size
+        file_name = f'benchmark_{chunk_size}.zip'
+        start, cpu_start = time.perf_counter(), time.process_time()
+        path = dl.download_to_file(url, file_name, segments=1)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        assert os.path.getsize(path) >= size
+        os.remove(path)
+        print(f'{chunk_size:>10} {elapsed:>8.2f} {size / 1e6 / elapsed:>8.1f} '
+              f'{cpu / (size / 1e9):>9.2f}')
+    dl.close()
+    server.terminate()
+
+
+def make_kml(path, n_placemarks, n_vertices):
+    """
+    This function writes a KML file with n_placemarks random polygons of
+    n_vertices each, like a statewide set of avalanche paths
+    """
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2 * np.pi, n_vertices)
+    with open(path, 'w') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="{KML_NS[1:-1]}">\n<Document>\n')
+        for i in range(n_placemarks):
+            lon, lat = rng.uniform(-109, -102), rng.uniform(37, 41)
+            radius = rng.uniform(0.001, 0.02, n_vertices)
+            coordinates = ' '.join(f'{x:.10f},{y:.10f},0' for x, y in
+                                   zip(lon + radius * np.cos(angles), lat + radius * np.sin(angles)))
+            f.write(f'<Placemark><name>path {i}</name><Polygon><outerBoundaryIs><LinearRing>'
+                    f'<coordinates>{coordinates}</coordinates>'
+                    f'</LinearRing></outerBoundaryIs></Polygon></Placemark>\n')
+        f.write('</Document>\n</kml>\n')
+
+
+def read_pykml(kml_file):
+    """
+    This function is the pykml objectify reader replaced by
+    KMLPolygons.read, kept as the benchmark baseline
+    """
+    with open(kml_file) as f:
+        doc = parser.parse(f).getroot()
+    rings = []
+    for e in doc.Document.findall(f'.//{KML_NS}Placemark'):
+        cords = e.Polygon.outerBoundaryIs.LinearRing['coordinates']
+        rings.append(np.asarray([p.split(',') for p in str(cords).strip().split()]).reshape(-1, 3).astype(float))
+    return rings
+
+
+def _measure(reader, kml_file, results):
+    start = time.perf_counter()
+    reader(kml_file)
+    results.put((time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def bench_kml(n_placemarks, n_vertices):
+    """
+    This function measures KML read time and peak memory of the pykml
+    objectify reader and the streaming KMLPolygons reader. Each read runs
+    in a new process, so the peaks do not mix.
+    """
+    kml_file = os.path.join(DATA_PATH, 'benchmark.kml')
+    os.makedirs(DATA_PATH, exist_ok=True)
+    make_kml(kml_file, n_placemarks, n_vertices)
+    size = os.path.getsize(kml_file)
+    print(f'KML read: {n_placemarks} placemarks x {n_vertices} vertices, {size / 1e6:.1f} MB')
+    print(f'{"reader":>12} {"seconds":>8} {"peak MB":>8}')
+    results = multiprocessing.Queue()
+    for name, reader in (('pykml', read_pykml), ('iterparse', KMLPolygons.read)):
+        process = multiprocessing.Process(target=_measure, args=(reader, kml_file, results))
+        process.start()
+        elapsed, peak = results.get()
+        process.join()
+        print(f'{name:>12} {elapsed:>8.2f} {peak / 1024:>8.1f}')
+    os.remove(kml_file)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+    benchmarks = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    options = benchmarks.add_parser('options', help='download-options batch size')
+    options.add_argument('--scenes', type=int, default=50000)
+    options.add_argument('--batch-sizes', type=int, nargs='+',
+                         default=[50000, 10000, 5000, 2000, 1000, 500])
+    options.add_argument('--workers', type=int, default=8)
+
+    segments = benchmarks.add_parser('segments', help='segmented download of one file')
+    segments.add_argument('--size', type=int, default=200, help='file size in MiB')
+    segments.add_argument('--segments', type=int, nargs='+', default=[1, 4, 8])
+    segments.add_argument('--rate', type=float, default=25, help='MB/s per connection')
+
+    chunks = benchmarks.add_parser('chunks', help='read and write chunk size')
+    chunks.add_argument('--size', type=int, default=500, help='file size in MiB')
+    chunks.add_argument('--chunk-sizes', type=int, nargs='+',
+                        default=[8192, 65536, 1 << 20, 4 << 20])
+
+    kml = benchmarks.add_parser('kml', help='KML reader')
+    kml.add_argument('--placemarks', type=int, default=2000)
+    kml.add_argument('--vertices', type=int, default=50)
+
+    args = arg_parser.parse_args()
+    if args.benchmark == 'options':
+        bench_download_options(args.scenes, args.batch_sizes, args.workers)
+    elif args.benchmark == 'segments':
+        bench_segments(args.size, args.segments, args.rate)
+    elif args.benchmark == 'chunks':
+        bench_chunks(args.size, args.chunk_sizes)
+    elif args.benchmark == 'kml':
+        bench_kml(args.placemarks, args.vertices)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Calls that change server state or carry credentials are never cached
+NEVER_CACHE = {'login', 'logout', 'download-request', 'download-retrieve'}
+
+
+class ResponseCache:
+    """
+    On-disk (SQLite) cache of M2M responses, keyed by account, endpoint
+    and the canonical JSON of the payload. Only endpoints with a TTL are
+    cached. When the cache grows past max_size bytes the least recently
+    used responses are evicted.
+
+    The account (service URL and username) keeps one user's results from
+    being served to another user of a shared cache file.
+    """
+
+    def __init__(self, path, ttls, max_size, account=''):
+        self.path = path
+        self.account = account
+        self.ttls = {endpoint: ttl for endpoint, ttl in ttls.items() if endpoint not in NEVER_CACHE}
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                    'key TEXT PRIMARY KEY, endpoint TEXT, created REAL, '
+                                    'accessed REAL, size INTEGER, body TEXT)')
+
+    def make_key(self, endpoint, payload) -> str:
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f'{self.account}\n{endpoint}\n{canonical}'.encode()).hexdigest()
+
+    def get(self, endpoint, payload):
+        """
+        This function returns a cached response
+
+        Parameters
+        ----------
+        endpoint : str
+            M2M request type.
+        payload : dict
+            request payload.
+
+        Returns
+        -------
+        dict, list or None
+            the cached response data, or None if it is not cached or expired.
+        """
+        if endpoint not in self.ttls:
+            return None
+        key = self.make_key(endpoint, payload)
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT created, body FROM responses WHERE key = ?',
+                                          (key,)).fetchone()
+            if row is None:
+                return None
+            created, body = row
+            if now - created > self.ttls[endpoint]:
+                self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(body)
+
+    def put(self, endpoint, payload, data):
+        """
+        This function caches a response and evicts the least recently used
+        responses past max_size
+
+        Parameters
+        ----------
+        endpoint : str
+            M2M request type.
+        payload : dict
+            request payload.
+        data : dict or list
+            response data.
+
+        Returns
+        -------
+        None.
+        """
+        if endpoint not in self.ttls or data is None:
+            return
+        key = self.make_key(endpoint, payload)
+        body = json.dumps(data)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                    (key, endpoint, now, now, len(body), body))
+            self.connection.execute('DELETE FROM responses WHERE key IN ('
+                                    'SELECT key FROM ('
+                                    'SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total '
+                                    'FROM responses) WHERE total > ?)', (self.max_size,))
+
+    def close(self):
+        """
+        This function closes the cache database
+
+        Returns
+        -------
+        None.
+        """
+        self.connection.close()
+
+
+class ApiKeyCache:
+    """
+    API keys persisted in a JSON file readable only by the user, so short
+    lived processes reuse one login until the key expires. Logins are
+    serialized across processes with a lock file, so many jobs starting at
+    once log in only once.
+    """
+
+    def __init__(self, path, ttl, lock_timeout=30):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
+        os.chmod(self.path, 0o600)
+
+    @contextmanager
+    def _locked(self):
+        lock_path = self.path + '.lock'
+        os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+        deadline = time.time() + self.lock_timeout
+        fd = None
+        while fd is None and time.time() < deadline:
+            try:
+                fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.lock_timeout:
+                        # left behind by a process that died while logging in
+                        os.remove(lock_path)
+                except OSError:
+                    pass
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+                os.remove(lock_path)
+
+    def get(self, service_url, username) -> str:
+        """
+        This function returns the cached API key of a user
+
+        Parameters
+        ----------
+        service_url : str
+            API url.
+        username : str
+            API user name.
+
+        Returns
+        -------
+        str
+            the API key, or None if there is no key or it expired.
+        """
+        entry = self._read().get(f'{username}@{service_url}')
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['apiKey']
+
+    def get_or_login(self, service_url, username, login, expired_key=None) -> str:
+        """
+        This function returns the cached API key, or logs in and caches the
+        new key when there is no valid one
+
+        Parameters
+        ----------
+        service_url : str
+            API url.
+        username : str
+            API user name.
+        login : callable
+            function that logs in and returns a new API key.
+        expired_key : str, optional
+            a key the server rejected. It is not returned even if the cache
+            still holds it. The default is None.
+
+        Returns
+        -------
+        str
+            the API key.
+        """
+        api_key = self.get(service_url, username)
+        if api_key is not None and api_key != expired_key:
+            return api_key
+        with self._locked():
+            # another process may have logged in while we waited for the lock
+            api_key = self.get(service_url, username)
+            if api_key is not None and api_key != expired_key:
+                return api_key
+            api_key = login()
+            entries = self._read()
+            entries[f'{username}@{service_url}'] = {'apiKey': api_key,
+                                                    'expires': time.time() + self.ttl}
+            self._write(entries)
+        return api_key
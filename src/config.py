@@ -11,3 +11,65 @@ try:
     dataset_names = config['DATASETS']['dataset'].split()
 except KeyError:
     dataset_names = ['WORLDVIEW-1', 'WORLDVIEW-2', 'WORLDVIEW-3']
+
+pool_size = config.getint('HTTP', 'pool_size', fallback=10)
+max_workers = config.getint('HTTP', 'max_workers', fallback=8)
+connect_timeout = config.getfloat('HTTP', 'connect_timeout', fallback=30)
+read_timeout = config.getfloat('HTTP', 'read_timeout', fallback=300)
+page_size = config.getint('SEARCH', 'page_size', fallback=100)
+options_batch_size = config.getint('SEARCH', 'options_batch_size', fallback=5000)
+footprint_filter = config.getboolean('SEARCH', 'footprint_filter', fallback=True)
+spatial_filter_type = config.get('SEARCH', 'spatial_filter', fallback='mbr')
+geojson_max_vertices = config.getint('SEARCH', 'geojson_max_vertices', fallback=500)
+download_workers = config.getint('DOWNLOAD', 'max_workers', fallback=4)
+host_workers = config.getint('DOWNLOAD', 'max_per_host', fallback=4)
+segments = config.getint('DOWNLOAD', 'segments', fallback=1)
+chunk_size = config.getint('DOWNLOAD', 'chunk_size', fallback=1 << 20)
+preallocate = config.getboolean('DOWNLOAD', 'preallocate', fallback=False)
+poll_interval = config.getfloat('POLL', 'interval', fallback=5)
+poll_max_interval = config.getfloat('POLL', 'max_interval', fallback=120)
+poll_backoff = config.getfloat('POLL', 'backoff', fallback=2)
+poll_jitter = config.getfloat('POLL', 'jitter', fallback=0.2)
+poll_timeout = config.getfloat('POLL', 'timeout', fallback=21600)
+queue_size = config.getint('PIPELINE', 'queue_size', fallback=64)
+state_db = config.get('STATE', 'db', fallback='../eros_state.sqlite')
+lookback_days = config.getint('STATE', 'lookback_days', fallback=7)
+
+cache_path = config.get('CACHE', 'path', fallback='')
+cache_max_size = config.getint('CACHE', 'max_size_mb', fallback=100) << 20
+api_key_path = config.get('CACHE', 'api_key_path', fallback='~/.eros_download/api_key.json')
+api_key_ttl = config.getfloat('CACHE', 'api_key_ttl', fallback=6600)
+try:
+    cache_ttls = {endpoint: config.getfloat('CACHE_TTL', endpoint) for endpoint in config['CACHE_TTL']}
+except KeyError:
+    cache_ttls = {'dataset-search': 3600, 'scene-search': 3600}
+
+retry_attempts = config.getint('RETRY', 'attempts', fallback=5)
+retry_backoff = config.getfloat('RETRY', 'backoff', fallback=1)
+retry_max_backoff = config.getfloat('RETRY', 'max_backoff', fallback=60)
+retry_jitter = config.getfloat('RETRY', 'jitter', fallback=0.5)
+
+rate_limit_path = config.get('RATE_LIMIT', 'shared_path', fallback='')
+try:
+    rate_limits = {endpoint: tuple(float(v) for v in config['RATE_LIMITS'][endpoint].split(','))
+                   for endpoint in config['RATE_LIMITS']}
+except KeyError:
+    rate_limits = {'default': (10.0, 20.0)}
+
+checksums = config.get('INTEGRITY', 'checksums', fallback='md5 sha256').split()
+manifest_path = config.get('INTEGRITY', 'manifest', fallback=f'{DATA_PATH}/checksums.json')
+verify_zip = config.getboolean('INTEGRITY', 'verify_zip', fallback=True)
+redownloads = config.getint('INTEGRITY', 'redownloads', fallback=2)
+
+extract = config.getboolean('EXTRACT', 'enabled', fallback=False)
+extract_path = config.get('EXTRACT', 'path', fallback='../extracted')
+extract_members = config.get('EXTRACT', 'members', fallback='').split()
+extract_workers = config.getint('EXTRACT', 'max_workers', fallback=2)
+delete_archives = config.getboolean('EXTRACT', 'delete_archive', fallback=False)
+
+max_bandwidth = config.getfloat('BANDWIDTH', 'max_mb_per_s', fallback=0) * 1e6
+unthrottled_window = config.get('BANDWIDTH', 'unthrottled_window', fallback='')
+try:
+    dataset_priorities = {dataset: config.getint('PRIORITY', dataset) for dataset in config['PRIORITY']}
+except KeyError:
+    dataset_priorities = {}
@@ -1,15 +1,41 @@
 import os
+import queue
+import threading
+import time
 import numpy as np
 import requests
-from datetime import datetime, timedelta
-from pykml import parser
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, time as day_time
+from urllib.parse import urlparse
 import logging
 
-from config import LOG_PATH, DATA_PATH
+from config import (LOG_PATH, DATA_PATH, pool_size, connect_timeout, read_timeout,
+                    download_workers, host_workers, segments, max_bandwidth, unthrottled_window, chunk_size, preallocate,
+                    checksums, manifest_path, verify_zip, redownloads, extract)
+from errors import IntegrityError
+from extract import Extractor
+from kml import KMLPolygons
+from integrity import Manifest, check_zip, expected_digests, hash_file, new_hashes
+from ratelimit import TokenBucket
 
+# Files are not split into byte ranges smaller than this
+MIN_SEGMENT_SIZE = 1 << 20
 
-class Download:
-    def __init__(self, date_range=14, log_mame=''):
+
+class DownloadBase:
+    """
+    State and helpers shared by the threaded Download client and the asyncio
+    client: the log, the date range, the bandwidth budget, the files already
+    downloaded, .part resume validators and the verification of finished
+    files. It sends no HTTP requests itself.
+    """
+
+    def __init__(self, date_range=14, log_mame='',
+                 max_bandwidth=max_bandwidth, unthrottled_window=unthrottled_window,
+                 chunk_size=chunk_size, preallocate=preallocate, checksums=checksums,
+                 manifest_path=manifest_path, verify_zip=verify_zip, redownloads=redownloads,
+                 extract=extract):
 
         os.makedirs(LOG_PATH, exist_ok=True)
         logger = logging.getLogger(f'{log_mame}_download')
@@ -18,53 +44,667 @@ class Download:
         fh.setFormatter(formatter)
         fh.setLevel(logging.DEBUG)
         logger.addHandler(fh)
+        # progress, e.g. the throughput of download_files, is logged at INFO
+        logger.setLevel(logging.INFO)
         self.logger = logger
         self.start = (datetime.now() - timedelta(days=date_range)).strftime('%Y-%m-%d')
         self.end = datetime.now().strftime('%Y-%m-%d')
+        self._present_files = None
+        self._saved_names = {}
+        self._present_files_lock = threading.Lock()
+        self.chunk_size = chunk_size
+        self.preallocate = preallocate
+        self.checksums = checksums
+        self.manifest = Manifest(manifest_path)
+        self.verify_zip = verify_zip
+        self.redownloads = redownloads
+        self.extractor = Extractor(manifest=self.manifest, logger=logger) if extract else None
+        # one second of transfer at the cap can be sent as a burst
+        self.bandwidth = TokenBucket(max_bandwidth, max_bandwidth) if max_bandwidth else None
+        self.unthrottled_window = None
+        if unthrottled_window:
+            self.unthrottled_window = tuple(day_time.fromisoformat(t.strip())
+                                            for t in unthrottled_window.split('-'))
+
+    def throttle_delay(self, nbytes) -> float:
+        """
+        This function takes nbytes from the bandwidth budget. There is no
+        budget when there is no cap or inside the unthrottled time window.
+
+        Parameters
+        ----------
+        nbytes : int
+            number of bytes received.
+
+        Returns
+        -------
+        float
+            seconds to wait before receiving more data.
+        """
+        if self.bandwidth is None:
+            return 0.0
+        if self.unthrottled_window is not None:
+            start, end = self.unthrottled_window
+            now = datetime.now().time()
+            if (start <= now < end) if start <= end else (now >= start or now < end):
+                return 0.0
+        return self.bandwidth.reserve(nbytes)
+
+    @property
+    def present_files(self) -> set:
+        """
+        Names of the files already in DATA_PATH, or extracted and deleted,
+        and the names they were requested under when the server renamed
+        them. The folder is listed once, on first use, and the set is
+        updated as downloads complete.
+        """
+        with self._present_files_lock:
+            if self._present_files is None:
+                os.makedirs(DATA_PATH, exist_ok=True)
+                listed = set(os.listdir(DATA_PATH))
+                self._present_files = set(listed)
+                for file_name, entry in self.manifest.entries().items():
+                    if file_name in listed or os.path.isdir(entry.get('extracted', '')):
+                        self._present_files.add(file_name)
+                        if 'requested' in entry:
+                            self._present_files.add(entry['requested'])
+                            self._saved_names[entry['requested']] = file_name
+        return self._present_files
+
+    def saved_name(self, file_name) -> str:
+        """
+        This function returns the name a file requested as file_name was
+        saved under, file_name itself unless the server renamed it
+        """
+        if file_name in self.present_files:
+            return self._saved_names.get(file_name, file_name)
+        return file_name
 
     def send_request(self, request, data, apiKey=None):
 
         raise NotImplementedError("Subclasses should implement this!")
 
-    def download_to_file(self, download_url, file_name) -> str:
+    @staticmethod
+    def resume_headers(part_name) -> tuple:
         """
-        This function download data from a URL and saves it as a zip file
+        This function returns the request headers that resume a .part file.
+        The Range is sent with If-Range and the validator of the response
+        the .part file came from, so the server sends the whole file again
+        if it changed. A .part file without a validator cannot be checked
+        and is started over.
 
         Parameters
         ----------
-        download_url : str
-            url to download the data.
+        part_name : str
+            path of the .part file.
+
+        Returns
+        -------
+        tuple
+            number of bytes in the .part file to resume from, and the
+            request headers.
+        """
+        try:
+            with open(part_name + '.validator') as f:
+                validator = f.read().strip()
+        except OSError:
+            validator = ''
+        offset = os.path.getsize(part_name) if os.path.exists(part_name) else 0
+        if not offset or not validator:
+            return 0, {}
+        return offset, {'Range': f'bytes={offset}-', 'If-Range': validator}
+
+    @staticmethod
+    def save_validator(part_name, headers):
+        """
+        This function saves the strong ETag, or else the Last-Modified date,
+        of the response a new .part file is written from. Without either the
+        .part file will not be resumed.
+
+        Parameters
+        ----------
+        part_name : str
+            path of the .part file.
+        headers : Mapping
+            response headers.
+
+        Returns
+        -------
+        None.
+        """
+        etag = headers.get('ETag', '')
+        validator = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified')
+        if validator:
+            with open(part_name + '.validator', 'w') as f:
+                f.write(validator)
+        elif os.path.exists(part_name + '.validator'):
+            os.remove(part_name + '.validator')
+
+    def finish_download(self, temp_name, file_name, size, hashes, expected, requested=None) -> str:
+        """
+        This function verifies a downloaded temporary file, moves it to
+        DATA_PATH and records its checksums in the manifest. A corrupt
+        file is removed.
+
+        Parameters
+        ----------
+        temp_name : str
+            path of the complete .part or .seg file.
         file_name : str
-            file path to save the data.
+            file name to save the data.
+        size : int
+            expected size, None when the server did not send it.
+        hashes : dict
+            hash objects fed with the whole file.
+        expected : dict
+            hex digests the server sent for the file.
+        requested : str, optional
+            file name the download was requested under. When the server
+            named the file differently, it is recorded in the manifest, so
+            the next runs skip the file without a request. The default is
+            None.
+
+        Raises
+        ------
+        IntegrityError
+            a checksum or the zip central directory does not match.
 
         Returns
         -------
         str
             path to the saved data.
         """
-        r = requests.head(download_url)
-        size = r.headers['Content-Length']
+        written = os.path.getsize(temp_name)
+        if size is not None and written != size:
+            raise IOError(f'{file_name} is incomplete ({written} of {size} bytes)')
+        digests = {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
         try:
-            filename = r.headers['Content-Disposition']
-            file_name = filename.replace('"', '').split('=')[1]
-        except KeyError:
-            pass
+            for algorithm, digest in expected.items():
+                if algorithm in digests and digests[algorithm] != digest:
+                    raise IntegrityError(f'{file_name} {algorithm} is {digests[algorithm]}, '
+                                         f'expected {digest}', file_name)
+            if self.verify_zip and file_name.lower().endswith('.zip'):
+                check_zip(temp_name, written)
+        except IntegrityError:
+            os.remove(temp_name)
+            raise
+        finally:
+            if os.path.exists(temp_name + '.validator'):
+                os.remove(temp_name + '.validator')
+        os.replace(temp_name, os.path.join(DATA_PATH, file_name))
+        entry = {'size': written, **digests}
+        if requested is not None and requested != file_name:
+            entry['requested'] = requested
+            self.present_files.add(requested)
+            self._saved_names[requested] = file_name
+        self.manifest.put(file_name, entry)
+        self.present_files.add(file_name)
         file_name = os.path.join(DATA_PATH, file_name)
-        if file_name not in os.listdir(DATA_PATH):
-            with requests.get(download_url, stream=True) as r:
-                r.raise_for_status()
-                with open(file_name, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
 
         self.logger.info(f'{file_name} is downloaded (size={size}')
         return file_name
 
+    def preallocate_file(self, f, offset, size):
+        """
+        This function reserves the disk blocks of a file from offset to
+        size when [DOWNLOAD] preallocate is on, so a large file is not
+        fragmented as it grows. The file size becomes size.
+
+        Parameters
+        ----------
+        f : file
+            file open for writing.
+        offset : int
+            first byte to reserve.
+        size : int
+            file size.
+
+        Returns
+        -------
+        None.
+        """
+        if not self.preallocate or not hasattr(os, 'posix_fallocate') or size <= offset:
+            return
+        try:
+            os.posix_fallocate(f.fileno(), offset, size - offset)
+        except OSError as e:
+            # e.g. the file system does not support it
+            self.logger.debug(f'Could not preallocate {f.name} ({e})')
+
+    def open_part(self, part_name, offset, size=None):
+        """
+        This function opens a .part file to write a download from offset.
+        When the size is known the rest of the file is preallocated.
+
+        Parameters
+        ----------
+        part_name : str
+            path of the .part file.
+        offset : int
+            number of bytes already in the .part file, 0 starts a new file.
+        size : int, optional
+            file size, None when the server did not send it.
+
+        Returns
+        -------
+        file
+            the .part file, positioned at offset.
+        """
+        f = open(part_name, 'r+b' if offset else 'wb')
+        f.seek(offset)
+        if size is not None:
+            self.preallocate_file(f, offset, size)
+        return f
+
+    @staticmethod
+    def write_chunk(f, chunk, hashes):
+        """
+        This function writes a piece of a download and feeds it to the
+        hashes
+        """
+        f.write(chunk)
+        for h in hashes.values():
+            h.update(chunk)
+
+    def close(self):
+        """
+        This function finishes the queued extractions
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.extractor is not None:
+            self.extractor.close()
+
+
+class Download(DownloadBase):
+    """
+    Downloads files with a pooled requests session, on a pool of threads
+    """
+
+    def __init__(self, date_range=14, log_mame='', pool_size=pool_size,
+                 max_bandwidth=max_bandwidth, unthrottled_window=unthrottled_window,
+                 chunk_size=chunk_size, preallocate=preallocate, checksums=checksums,
+                 manifest_path=manifest_path, verify_zip=verify_zip, redownloads=redownloads,
+                 extract=extract):
+        super().__init__(date_range, log_mame, max_bandwidth, unthrottled_window, chunk_size,
+                         preallocate, checksums, manifest_path, verify_zip, redownloads, extract)
+        self.session = self.make_session(pool_size)
+        # a stalled connection raises requests.Timeout instead of hanging
+        self.timeout = (connect_timeout, read_timeout)
+
+    def throttle(self, nbytes):
+        """
+        This function waits until nbytes more fit in the bandwidth cap
+
+        Parameters
+        ----------
+        nbytes : int
+            number of bytes received.
+
+        Returns
+        -------
+        None.
+        """
+        delay = self.throttle_delay(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def make_session(pool_size) -> requests.Session:
+        """
+        This function creates a keep-alive HTTP session with a connection pool,
+        so repeated requests to the same host reuse the TCP/TLS connection
+
+        Parameters
+        ----------
+        pool_size : int
+            max number of connections to keep open per host.
+
+        Returns
+        -------
+        requests.Session
+            the pooled session.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        """
+        This function closes the HTTP session and releases its pooled
+        connections. Queued extractions are finished first.
+
+        Returns
+        -------
+        None.
+
+        """
+        super().close()
+        self.session.close()
+
+    def download_to_file(self, download_url, file_name, segments: int = segments) -> str:
+        """
+        This function download data from a URL and saves it as a zip file.
+        Files already in DATA_PATH, under file_name or the name the server
+        gave them on an earlier run, are skipped without a request. The size and
+        name are read from the headers of the download response itself.
+        The data is written to <file_name>.part and renamed once complete, so
+        an interrupted download is resumed with a Range request on the next run.
+        Checksums are computed while the data is written and recorded in the
+        manifest. A file that fails verification is downloaded again.
+
+        Parameters
+        ----------
+        download_url : str
+            url to download the data.
+        file_name : str
+            file name to save the data. Replaced by the name in the
+            Content-Disposition header when the server sends one.
+        segments : int, optional
+            number of byte ranges to fetch in parallel. Used only when the
+            server accepts ranges, otherwise the file is fetched as a single
+            stream. The default is segments from the [DOWNLOAD] section of
+            the cfng file.
+
+        Returns
+        -------
+        str
+            path to the saved data.
+        """
+        for attempt in range(self.redownloads + 1):
+            try:
+                return self._download_to_file(download_url, file_name, segments)
+            except IntegrityError as e:
+                if attempt == self.redownloads:
+                    raise
+                self.logger.warning(f'{e}, downloading it again')
+
+    def _download_to_file(self, download_url, file_name, segments):
+        if file_name in self.present_files:
+            file_name = os.path.join(DATA_PATH, self.saved_name(file_name))
+            self.logger.info(f'{file_name} is already downloaded')
+            return file_name
+
+        requested = file_name
+        part_name = os.path.join(DATA_PATH, file_name + '.part')
+        offset, headers = self.resume_headers(part_name)
+        r = self.session.get(download_url, stream=True, headers=headers, timeout=self.timeout)
+        if r.status_code == 416:
+            # The .part file is at least as long as the file, start over
+            r.close()
+            offset = 0
+            r = self.session.get(download_url, stream=True, timeout=self.timeout)
+        with r:
+            r.raise_for_status()
+            if offset and not (r.status_code == 206 and
+                               r.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                # The file changed or the server ignored the range, start over
+                offset = 0
+            if r.status_code == 206:
+                size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+            else:
+                size = r.headers.get('Content-Length')
+                size = int(size) if size is not None else None
+            try:
+                filename = r.headers['Content-Disposition']
+                file_name = filename.replace('"', '').split('=')[1]
+            except KeyError:
+                pass
+            if file_name in self.present_files:
+                file_name = os.path.join(DATA_PATH, file_name)
+                self.logger.info(f'{file_name} is already downloaded')
+                return file_name
+            expected = expected_digests(r.headers) if r.status_code == 200 else {}
+
+            accept_ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+            segments = min(segments, size // MIN_SEGMENT_SIZE) if size else 1
+            if not offset and segments > 1 and accept_ranges:
+                temp_name = part_name[:-len('.part')] + '.seg'
+                self.download_segments(r, temp_name, size, segments)
+                # the ranges arrive out of order, so they are hashed once complete
+                hashes = hash_file(temp_name, new_hashes(self.checksums), chunk_size=self.chunk_size)
+            else:
+                temp_name = part_name
+                if not offset:
+                    self.save_validator(part_name, r.headers)
+                hashes = self.download_stream(r, temp_name, offset, size)
+
+        return self.finish_download(temp_name, file_name, size, hashes, expected, requested)
+
+    def iter_body(self, response):
+        """
+        This function yields the body of a streaming response in chunk_size
+        pieces. urllib3 has no zero-copy readinto, it reads a new bytes
+        object and copies it, so iter_content is as cheap, decodes the body
+        and lets the connection go back to the pool once it is read.
+
+        Parameters
+        ----------
+        response : requests.Response
+            streaming response of a download request.
+
+        Yields
+        ------
+        bytes
+            next piece of the body.
+        """
+        return response.iter_content(chunk_size=self.chunk_size)
+
+    def download_stream(self, response, part_name, offset, size=None):
+        """
+        This function writes a download response to a .part file as a
+        single stream. When the size is known the file is preallocated.
+
+        Parameters
+        ----------
+        response : requests.Response
+            streaming response of the download request.
+        part_name : str
+            path of the .part file.
+        offset : int
+            number of bytes already in the .part file. The response body
+            is appended to them, 0 starts a new file.
+        size : int, optional
+            file size, None when the server did not send it.
+
+        Returns
+        -------
+        dict
+            hash objects fed with the whole .part file.
+        """
+        hashes = new_hashes(self.checksums)
+        if offset:
+            self.logger.info(f'Resuming {part_name} from byte {offset}')
+            hash_file(part_name, hashes, offset, self.chunk_size)
+        with self.open_part(part_name, offset, size) as f:
+            try:
+                for chunk in self.iter_body(response):
+                    self.write_chunk(f, chunk, hashes)
+                    self.throttle(len(chunk))
+            finally:
+                # the length of the .part file is where the next run resumes
+                f.truncate()
+        return hashes
+
+    def download_segments(self, response, seg_name, size, segments):
+        """
+        This function splits a file into byte ranges and fetches them in
+        parallel into a preallocated .seg file. Each range is written at its
+        own offset. The first range is read from the already open response.
+
+        Parameters
+        ----------
+        response : requests.Response
+            streaming response of the full file download request.
+        seg_name : str
+            path of the .seg file.
+        size : int
+            file size from Content-Length.
+        segments : int
+            number of byte ranges.
+
+        Returns
+        -------
+        None.
+        """
+        download_url = response.url
+        with open(seg_name, 'wb') as f:
+            f.truncate(size)
+            self.preallocate_file(f, 0, size)
+        bounds = np.linspace(0, size, segments + 1).astype(int)
+
+        def write_range(r, first, last):
+            with open(seg_name, 'r+b') as f:
+                f.seek(first)
+                remaining = last - first + 1
+                for chunk in self.iter_body(r):
+                    f.write(chunk[:remaining])
+                    remaining -= len(chunk)
+                    self.throttle(len(chunk))
+                    if remaining <= 0:
+                        break
+            if remaining > 0:
+                raise IOError(f'{seg_name} range {first}-{last} is incomplete '
+                              f'({last - first + 1 - remaining} of {last - first + 1} bytes)')
+
+        def download_range(first, last):
+            headers = {'Range': f'bytes={first}-{last}'}
+            with self.session.get(download_url, stream=True, headers=headers, timeout=self.timeout) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError(f'{download_url} ignored the range {first}-{last}')
+                write_range(r, first, last)
+
+        try:
+            with ThreadPoolExecutor(max_workers=segments - 1) as executor:
+                futures = [executor.submit(download_range, first, last - 1)
+                           for first, last in zip(bounds[1:-1], bounds[2:])]
+                write_range(response, 0, bounds[1] - 1)
+                for future in futures:
+                    future.result()
+        except Exception:
+            os.remove(seg_name)
+            raise
+
+    def download_files(self,
+                       jobs,
+                       max_workers: int = download_workers,
+                       max_per_host: int = host_workers) -> list:
+        """
+        This function downloads many files at once on a bounded worker pool,
+        calling download_to_file for each (download_url, file_name) job.
+        Waiting jobs are started in priority order. With [EXTRACT] enabled,
+        each zip file is extracted as soon as it is downloaded.
+
+        Parameters
+        ----------
+        jobs : iterable
+            (download_url, file_name) or (download_url, file_name, priority)
+            tuples. Lower priorities are started first, the default is 0.
+            Jobs are queued as they are taken from the iterable, so it can
+            be a generator.
+        max_workers : int, optional
+            max number of downloads in flight overall. The default is
+            max_workers from the [DOWNLOAD] section of the cfng file.
+        max_per_host : int, optional
+            max number of downloads in flight from the same host. The
+            default is max_per_host from the [DOWNLOAD] section.
+
+        Returns
+        -------
+        list
+            dict for each job with url, file_name (path of the saved data),
+            size (bytes), seconds, error (None on success) and extracted
+            (extraction folder, None when not extracted).
+        """
+        host_slots = {}
+        host_slots_lock = threading.Lock()
+
+        def download(download_url, file_name):
+            host = urlparse(download_url).netloc
+            with host_slots_lock:
+                slot = host_slots.setdefault(host, threading.BoundedSemaphore(max_per_host))
+            result = {'url': download_url, 'file_name': file_name,
+                      'size': 0, 'seconds': 0.0, 'error': None, 'extracted': None}
+            with slot:
+                start = time.perf_counter()
+                try:
+                    result['file_name'] = self.download_to_file(download_url, file_name)
+                    if os.path.exists(result['file_name']):
+                        # else it was extracted and deleted by an earlier run
+                        result['size'] = os.path.getsize(result['file_name'])
+                except Exception as e:
+                    result['error'] = e
+                    self.logger.warning(f'Failed to download {download_url} ({e})')
+                result['seconds'] = time.perf_counter() - start
+            if (self.extractor is not None and result['error'] is None
+                    and result['file_name'].lower().endswith('.zip')
+                    and os.path.exists(result['file_name'])):
+                extractions[id(result)] = self.extractor.submit(result['file_name'])
+            return result
+
+        waiting = queue.PriorityQueue()
+        done = {}
+        extractions = {}
+
+        def worker():
+            while True:
+                _, index, download_url, file_name = waiting.get()
+                if download_url is None:
+                    return
+                done[index] = download(download_url, file_name)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(max_workers)]
+        for thread in workers:
+            thread.start()
+        count = 0
+        try:
+            for job in jobs:
+                priority = job[2] if len(job) > 2 else 0
+                waiting.put((priority, count, job[0], job[1]))
+                count += 1
+        except BaseException:
+            # the results will not be returned, so only the downloads in
+            # flight are finished
+            while True:
+                try:
+                    waiting.get_nowait()
+                except queue.Empty:
+                    break
+            raise
+        finally:
+            for _ in workers:
+                # sorts after every job, so the workers stop once the queue is empty
+                waiting.put((float('inf'), count, None, None))
+            for thread in workers:
+                thread.join()
+        results = [done[index] for index in range(count)]
+        for result in results:
+            if id(result) in extractions:
+                try:
+                    result['extracted'] = extractions[id(result)].result()
+                except Exception as e:
+                    self.logger.warning(f'Failed to extract {result["file_name"]} ({e})')
+        elapsed = time.perf_counter() - start
+
+        total_size = sum(result['size'] for result in results)
+        failed = sum(result['error'] is not None for result in results)
+        self.logger.info(f'Downloaded {len(results) - failed}/{len(results)} files, '
+                         f'{total_size / 1e6:.1f} MB in {elapsed:.1f} s '
+                         f'({total_size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)')
+        return results
+
     @ classmethod
     def get_area_rect_from_klm(cls, kml_file):
         """
-        This function gets a KML file with a polygon and returns the upper right
-        and lower left corners of the polygon's bounding box
+        This function gets a KML file with polygons and returns the upper right
+        and lower left corners of the bounding box of all the polygons
 
         Parameters
         ----------
@@ -78,21 +718,7 @@ class Download:
         upper_right : dict
             {'latitude' : right_lat, 'longitude' : upper_long}.
         """
-        with open(kml_file) as f:
-            doc = parser.parse(f).getroot()
-        cords = []
-        for e in doc.Document.findall('.//{http://www.opengis.net/kml/2.2}Placemark'):
-            cords = e.Polygon.outerBoundaryIs.LinearRing['coordinates']
-
-        cords = np.asarray([p.split(',') for p in str(cords).strip().split()]).reshape(-1, 3).astype(float)
-        lower_long = cords[:, 0].min()
-        upper_long = cords[:, 0].max()
-        left_lat = cords[:, 1].min()
-        right_lat = cords[:, 1].max()
+        lower_long, left_lat, upper_long, right_lat = KMLPolygons.read(kml_file).union_bounds().tolist()
         lower_left = {'latitude': left_lat, 'longitude': lower_long}
         upper_right = {'latitude': right_lat, 'longitude': upper_long}
         return lower_left, upper_right
-
-
-
-
@@ -0,0 +1,161 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from config import retry_backoff, retry_max_backoff, retry_jitter
+
+# errorCodes of a rejected or expired API key
+AUTH_ERRORS = {'AUTH_INVALID', 'AUTH_KEY_INVALID', 'AUTH_UNAUTHORIZED', 'AUTH_UNAUTHROIZED'}
+
+
+class EROSError(Exception):
+    """
+    Base class of the errors raised by the EROS download module
+    """
+
+
+class APIError(EROSError):
+    """
+    The M2M API rejected a request
+
+    Parameters
+    ----------
+    message : str
+        error description.
+    error_code : str, optional
+        M2M errorCode. The default is None.
+    status_code : int, optional
+        HTTP status code. The default is None.
+    retry_after : float, optional
+        seconds the server asked to wait before retrying. The default is None.
+    """
+
+    def __init__(self, message, error_code=None, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.error_code = error_code
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AuthError(APIError):
+    """
+    The API key or the credentials were rejected
+    """
+
+
+class RateLimitError(APIError):
+    """
+    The request exceeded an M2M rate limit. It can be retried later.
+    """
+
+
+class TransientError(APIError):
+    """
+    Server error or network failure. It can be retried.
+    """
+
+
+class IntegrityError(EROSError):
+    """
+    A downloaded file failed its checksum or zip validation
+
+    Parameters
+    ----------
+    message : str
+        error description.
+    file_name : str
+        the corrupt file.
+    """
+
+    def __init__(self, message, file_name):
+        super().__init__(message)
+        self.file_name = file_name
+
+
+def parse_retry_after(value) -> float:
+    """
+    This function parses a Retry-After header
+
+    Parameters
+    ----------
+    value : str or None
+        header value, seconds or an HTTP date.
+
+    Returns
+    -------
+    float
+        seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_response(url, status_code, output, retry_after=None):
+    """
+    This function raises the error matching an M2M response
+
+    Parameters
+    ----------
+    url : str
+        request url.
+    status_code : int
+        HTTP status code.
+    output : dict or None
+        parsed JSON response, None if the body is not JSON.
+    retry_after : float, optional
+        seconds from the Retry-After header. The default is None.
+
+    Returns
+    -------
+    None.
+    """
+    output = output or {}
+    error_code = output.get('errorCode')
+    if error_code is None and status_code < 400 and 'data' in output:
+        return
+    error_message = output.get('errorMessage') or ('No output from service' if not output else None)
+    message = f'{url} failed: {error_code or status_code}'
+    if error_message:
+        message += f' - {error_message}'
+    if status_code == 401 or error_code in AUTH_ERRORS:
+        error_class = AuthError
+    elif status_code == 429 or (error_code or '').startswith('RATE_LIMIT'):
+        error_class = RateLimitError
+    elif status_code >= 500 or (not output and status_code < 400):
+        # a truncated 2xx body is retried, a 4xx page from e.g. a proxy is not
+        error_class = TransientError
+    else:
+        error_class = APIError
+    raise error_class(message, error_code, status_code, retry_after)
+
+
+def retry_delay(attempt, error=None) -> float:
+    """
+    This function returns how long to wait before retrying a request:
+    the server's Retry-After if it sent one, otherwise exponential
+    backoff with jitter
+
+    Parameters
+    ----------
+    attempt : int
+        number of failed attempts so far (1 for the first retry).
+    error : APIError, optional
+        the error of the last attempt. The default is None.
+
+    Returns
+    -------
+    float
+        seconds to wait.
+    """
+    if error is not None and getattr(error, 'retry_after', None) is not None:
+        return error.retry_after
+    delay = min(retry_backoff * 2 ** (attempt - 1), retry_max_backoff)
+    return delay * random.uniform(1 - retry_jitter, 1 + retry_jitter)
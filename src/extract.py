@@ -0,0 +1,109 @@
+import fnmatch
+import logging
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from config import extract_path, extract_members, extract_workers, delete_archives
+
+
+class Extractor:
+    """
+    Extracts the selected members of downloaded zip files on a worker pool,
+    while the archives are still in the page cache
+
+    Parameters
+    ----------
+    path : str, optional
+        folder to extract to. Each archive gets a subfolder named after it.
+        The default is path from the [EXTRACT] section of the cfng file.
+    members : list, optional
+        shell patterns of the members to extract, matched without case
+        against the member's base name. Empty extracts everything. The
+        default is members from the [EXTRACT] section.
+    delete_archive : bool, optional
+        remove each archive once it is extracted. The default is
+        delete_archive from the [EXTRACT] section.
+    max_workers : int, optional
+        number of archives extracted at once. The default is max_workers
+        from the [EXTRACT] section.
+    manifest : integrity.Manifest, optional
+        manifest to record the extraction folder in. The default is None.
+    logger : logging.Logger, optional
+        logger of the client the archives are downloaded by. The default is
+        None, the 'extract' logger.
+    """
+
+    def __init__(self, path=extract_path, members=extract_members, delete_archive=delete_archives,
+                 max_workers=extract_workers, manifest=None, logger=None):
+        self.path = path
+        self.members = [member.lower() for member in members]
+        self.delete_archive = delete_archive
+        self.manifest = manifest
+        self.logger = logger or logging.getLogger('extract')
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def selected(self, member_name) -> bool:
+        """
+        This function tells if a member matches one of the patterns
+        """
+        name = os.path.basename(member_name).lower()
+        return not self.members or any(fnmatch.fnmatch(name, pattern) for pattern in self.members)
+
+    def submit(self, zip_path):
+        """
+        This function queues a zip file for extraction
+
+        Parameters
+        ----------
+        zip_path : str
+            path of the downloaded zip file.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolves to the extraction folder.
+        """
+        return self.executor.submit(self.extract, zip_path)
+
+    def extract(self, zip_path) -> str:
+        """
+        This function extracts the selected members of a zip file. They are
+        extracted to a temporary folder that is renamed once complete, so
+        an interrupted extraction leaves no partial folder behind. Member
+        CRCs are checked as they are read.
+
+        Parameters
+        ----------
+        zip_path : str
+            path of the zip file.
+
+        Returns
+        -------
+        str
+            extraction folder.
+        """
+        file_name = os.path.basename(zip_path)
+        out_dir = os.path.join(self.path, os.path.splitext(file_name)[0])
+        if not os.path.isdir(out_dir):
+            temp_dir = out_dir + '.tmp'
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            with zipfile.ZipFile(zip_path) as zf:
+                for member in zf.infolist():
+                    if not member.is_dir() and self.selected(member.filename):
+                        zf.extract(member, temp_dir)
+            os.makedirs(temp_dir, exist_ok=True)
+            os.replace(temp_dir, out_dir)
+            self.logger.info(f'{zip_path} is extracted to {out_dir}')
+        if self.manifest is not None:
+            self.manifest.update(file_name, extracted=out_dir)
+        if self.delete_archive:
+            os.remove(zip_path)
+        return out_dir
+
+    def close(self):
+        """
+        This function waits for the queued extractions and stops the workers
+        """
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,369 @@
+import heapq
+
+import numpy as np
+
+from config import spatial_filter_type, geojson_max_vertices
+
+
+def make_spatial_filter(polygons,
+                        filter_type: str = spatial_filter_type,
+                        max_vertices: int = geojson_max_vertices) -> dict:
+    """
+    This function builds the M2M spatial filter of an area of interest
+
+    Parameters
+    ----------
+    polygons : kml.KMLPolygons
+        polygons of the area of interest.
+    filter_type : str, optional
+        mbr or geojson. The default is spatial_filter from the [SEARCH]
+        section of the cfng file.
+    max_vertices : int, optional
+        max number of vertices of a geojson filter. The default is
+        geojson_max_vertices from the [SEARCH] section.
+
+    Returns
+    -------
+    dict
+        spatialFilter of a dataset-search or scene-search. A geojson filter
+        that cannot be simplified to max_vertices falls back to mbr.
+    """
+    if filter_type == 'geojson':
+        spatial_filter = geojson_filter(polygons, max_vertices)
+        if spatial_filter is not None:
+            return spatial_filter
+    return mbr_filter(polygons)
+
+
+def mbr_filter(polygons) -> dict:
+    """
+    This function builds the M2M mbr spatial filter of the bounding box of
+    all the polygons
+
+    Parameters
+    ----------
+    polygons : kml.KMLPolygons
+        polygons of the area of interest.
+
+    Returns
+    -------
+    dict
+        spatialFilter of a dataset-search or scene-search.
+    """
+    lower_long, left_lat, upper_long, right_lat = polygons.union_bounds().tolist()
+    return {'filterType': 'mbr',
+            'lowerLeft': {'latitude': left_lat, 'longitude': lower_long},
+            'upperRight': {'latitude': right_lat, 'longitude': upper_long}}
+
+
+def cross2d(u, v) -> np.ndarray:
+    """
+    This function returns the z component of the cross product of 2D
+    vectors, positive when v turns counterclockwise from u
+    """
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def convex_hull(points) -> np.ndarray:
+    """
+    This function computes the convex hull of points with the monotone
+    chain algorithm
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (n, 2) points.
+
+    Returns
+    -------
+    np.ndarray
+        (m, 2) hull vertices counterclockwise, not closed.
+    """
+    points = np.unique(points, axis=0)
+    if len(points) < 3:
+        return points
+
+    def half(points):
+        chain = []
+        for x, y in points:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (y - chain[-2][1]) -
+                                       (chain[-1][1] - chain[-2][1]) * (x - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append((x, y))
+        return chain[:-1]
+
+    points = points.tolist()
+    return np.array(half(points) + half(points[::-1]))
+
+
+def reduce_hulls(hulls, max_vertices) -> list:
+    """
+    This function removes vertices from convex polygons while keeping each
+    one enclosing the original. An edge is removed by extending its two
+    neighbor edges until they meet, choosing each time the edge that adds
+    the least area. The cheapest removal of each polygon is kept in a heap,
+    so only the polygon that changed is recomputed.
+
+    Parameters
+    ----------
+    hulls : list
+        (n, 2) counterclockwise vertices of each convex polygon.
+    max_vertices : int
+        max total number of vertices.
+
+    Returns
+    -------
+    list
+        the enclosing polygons, None when they cannot be reduced to
+        max_vertices.
+    """
+    hulls = list(hulls)
+
+    def cheapest(k):
+        # for edge b-c: a-b and c-d extended meet at b + t * (b - a)
+        hull = hulls[k]
+        if len(hull) <= 3:
+            return None
+        a, b = np.roll(hull, 1, axis=0), hull
+        c, d = np.roll(hull, -1, axis=0), np.roll(hull, -2, axis=0)
+        turn = cross2d(b - a, d - c)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            t = np.where(turn > 0, cross2d(c - b, d - c) / np.where(turn > 0, turn, 1), np.inf)
+            meet = b + t[:, None] * (b - a)
+            added = np.abs(cross2d(meet - b, c - b)) / 2
+        added[~np.isfinite(added)] = np.inf
+        i = int(np.argmin(added))
+        if not np.isfinite(added[i]):
+            return None
+        return added[i], k, i, meet[i]
+
+    heap = [removal for removal in map(cheapest, range(len(hulls))) if removal is not None]
+    heapq.heapify(heap)
+    total = sum(len(hull) for hull in hulls)
+    while total > max_vertices:
+        if not heap:
+            return None
+        _, k, i, meet = heapq.heappop(heap)
+        hull = hulls[k].copy()
+        hull[i] = meet
+        hulls[k] = np.delete(hull, (i + 1) % len(hull), axis=0)
+        total -= 1
+        removal = cheapest(k)
+        if removal is not None:
+            heapq.heappush(heap, removal)
+    return hulls
+
+
+def geojson_filter(polygons, max_vertices) -> dict:
+    """
+    This function builds an M2M geojson spatial filter of the polygons.
+    When they have more than max_vertices vertices, each polygon is
+    replaced by its convex hull, and the hulls are reduced by enlarging
+    them, so the filter always encloses the polygons.
+
+    Parameters
+    ----------
+    polygons : kml.KMLPolygons
+        polygons of the area of interest.
+    max_vertices : int
+        max number of vertices in the filter.
+
+    Returns
+    -------
+    dict
+        spatialFilter, None when the polygons do not fit in max_vertices.
+    """
+    if 4 * len(polygons) > max_vertices:
+        # not even a closed triangle per polygon fits
+        return None
+    rings = [[np.vstack([ring, ring[:1]]) if np.any(ring[0] != ring[-1]) else ring
+              for ring in polygons.rings(i)] for i in range(len(polygons))]
+    if sum(len(ring) for polygon in rings for ring in polygon) > max_vertices:
+        # every closed ring repeats its first vertex
+        hulls = reduce_hulls([convex_hull(polygon[0]) for polygon in rings],
+                             max_vertices - len(rings))
+        if hulls is None or any(len(hull) < 3 for hull in hulls):
+            return None
+        rings = [[np.vstack([hull, hull[:1]])] for hull in hulls]
+    coordinates = [[ring.tolist() for ring in polygon] for polygon in rings]
+    if len(coordinates) == 1:
+        geo_json = {'type': 'Polygon', 'coordinates': coordinates[0]}
+    else:
+        geo_json = {'type': 'MultiPolygon', 'coordinates': coordinates}
+    return {'filterType': 'geojson', 'geoJson': geo_json}
+
+
+def geojson_rings(geometry) -> list:
+    """
+    This function returns the rings of a GeoJSON Polygon or MultiPolygon
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON geometry, e.g. the spatialCoverage of a scene-search result.
+
+    Returns
+    -------
+    list
+        (n, 2) longitude, latitude array for each ring. None for other
+        geometry types.
+    """
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return None
+    return [np.asarray(ring, dtype=float)[:, :2] for polygon in polygons for ring in polygon if len(ring)]
+
+
+def ring_edges(coords, ring_offsets) -> np.ndarray:
+    """
+    This function returns the edges of rings stored one after the other,
+    closing each ring from its last vertex to its first
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        (n, 2) vertices of all the rings.
+    ring_offsets : np.ndarray
+        start of each ring in coords, plus n.
+
+    Returns
+    -------
+    np.ndarray
+        (n, 4) x1, y1, x2, y2 of each edge.
+    """
+    following = np.arange(1, len(coords) + 1)
+    following[ring_offsets[1:] - 1] = ring_offsets[:-1]
+    return np.hstack([coords, coords[following]])
+
+
+def crossings(points, edges) -> np.ndarray:
+    """
+    This function tests which edges a ray from each point towards +x
+    crosses. Points cross the edges of a polygon an odd number of times
+    when inside it.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (k, 2) points.
+    edges : np.ndarray
+        (e, 4) edges.
+
+    Returns
+    -------
+    np.ndarray
+        (k, e) boolean.
+    """
+    x, y = points[:, :1], points[:, 1:]
+    x1, y1, x2, y2 = edges.T
+    straddle = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return straddle & (x < x_cross)
+
+
+def segments_intersect(a, b) -> bool:
+    """
+    This function tests if any segment of a touches any segment of b
+
+    Parameters
+    ----------
+    a : np.ndarray
+        (m, 4) segments.
+    b : np.ndarray
+        (e, 4) segments.
+
+    Returns
+    -------
+    bool
+    """
+    ax1, ay1, ax2, ay2 = (v[:, None] for v in a.T)
+    bx1, by1, bx2, by2 = b.T
+
+    def orient(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    straddle_b = orient(bx1, by1, bx2, by2, ax1, ay1) * orient(bx1, by1, bx2, by2, ax2, ay2) <= 0
+    straddle_a = orient(ax1, ay1, ax2, ay2, bx1, by1) * orient(ax1, ay1, ax2, ay2, bx2, by2) <= 0
+    # rules out collinear segments that do not overlap
+    overlap = ((np.minimum(ax1, ax2) <= np.maximum(bx1, bx2)) & (np.minimum(bx1, bx2) <= np.maximum(ax1, ax2)) &
+               (np.minimum(ay1, ay2) <= np.maximum(by1, by2)) & (np.minimum(by1, by2) <= np.maximum(ay1, ay2)))
+    return bool(np.any(straddle_a & straddle_b & overlap))
+
+
+class FootprintFilter:
+    """
+    Tests scene footprints against the exact polygons of an area of
+    interest, instead of their bounding box. Polygon holes are honored.
+
+    Parameters
+    ----------
+    polygons : kml.KMLPolygons
+        polygons of the area of interest.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = polygons
+        self.bounds = polygons.bounds()
+        self.edges = ring_edges(polygons.coords, polygons.ring_offsets)
+        # edges of polygon i are edges[polygon_edges[i]: polygon_edges[i + 1]]
+        self.polygon_edges = polygons.ring_offsets[polygons.polygon_rings]
+
+    def intersects(self, geometry) -> bool:
+        """
+        This function tests if a footprint touches any of the polygons
+
+        Parameters
+        ----------
+        geometry : dict
+            GeoJSON Polygon or MultiPolygon footprint.
+
+        Returns
+        -------
+        bool
+            True when they intersect, or when the footprint is not a polygon.
+        """
+        rings = geojson_rings(geometry)
+        if not rings:
+            return True
+        footprint = np.concatenate(rings)
+        offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings])])
+        footprint_edges = ring_edges(footprint, offsets)
+        lower, upper = footprint.min(axis=0), footprint.max(axis=0)
+        candidates = np.flatnonzero((self.bounds[:, 0] <= upper[0]) & (self.bounds[:, 2] >= lower[0]) &
+                                    (self.bounds[:, 1] <= upper[1]) & (self.bounds[:, 3] >= lower[1]))
+        if not len(candidates):
+            return False
+        first, last = self.polygon_edges[candidates], self.polygon_edges[candidates + 1]
+        counts = last - first
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        edges = self.edges[np.repeat(first - starts, counts) + np.arange(counts.sum())]
+
+        # a footprint vertex inside a polygon
+        if np.any(np.add.reduceat(crossings(footprint, edges), starts, axis=1) % 2):
+            return True
+        # a polygon vertex inside the footprint
+        if np.any(crossings(edges[:, :2], footprint_edges).sum(axis=1) % 2):
+            return True
+        return segments_intersect(footprint_edges, edges)
+
+    def filter(self, scenes) -> list:
+        """
+        This function drops the scenes whose spatialCoverage does not
+        touch the polygons. Scenes without one are kept.
+
+        Parameters
+        ----------
+        scenes : list
+            scene-search results.
+
+        Returns
+        -------
+        list
+            the scenes that intersect the polygons.
+        """
+        return [scene for scene in scenes
+                if not scene.get('spatialCoverage') or self.intersects(scene['spatialCoverage'])]
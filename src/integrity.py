@@ -0,0 +1,204 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import zipfile
+
+from errors import IntegrityError
+
+
+def new_hashes(algorithms) -> dict:
+    """
+    This function starts one hashlib object per algorithm
+
+    Parameters
+    ----------
+    algorithms : iterable
+        hashlib algorithm names, e.g. md5 and sha256.
+
+    Returns
+    -------
+    dict
+        hash object for each algorithm.
+    """
+    return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+
+def hash_file(path, hashes, size=None, chunk_size=1 << 20) -> dict:
+    """
+    This function feeds the first size bytes of a file to hashes. Used for
+    the part of a file that was not streamed by this run.
+
+    Parameters
+    ----------
+    path : str
+        file path.
+    hashes : dict
+        hash objects from new_hashes.
+    size : int, optional
+        number of bytes to hash. The default is None, the whole file.
+    chunk_size : int, optional
+        bytes read per step. The default is 1 MiB.
+
+    Returns
+    -------
+    dict
+        the same hash objects.
+    """
+    remaining = os.path.getsize(path) if size is None else size
+    buffer = memoryview(bytearray(chunk_size))
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            n = f.readinto(buffer[:min(chunk_size, remaining)])
+            if not n:
+                break
+            for h in hashes.values():
+                h.update(buffer[:n])
+            remaining -= n
+    return hashes
+
+
+def expected_digests(headers) -> dict:
+    """
+    This function reads the checksums a server sent for the full file,
+    from the Content-MD5 and Digest headers
+
+    Parameters
+    ----------
+    headers : Mapping
+        response headers of a full (200) download response.
+
+    Returns
+    -------
+    dict
+        hex digest for each hashlib algorithm name.
+    """
+    encoded = {}
+    if headers.get('Content-MD5'):
+        encoded['md5'] = headers['Content-MD5']
+    for item in headers.get('Digest', '').split(','):
+        algorithm, _, value = item.strip().partition('=')
+        algorithm = algorithm.lower().replace('-', '')
+        if value and algorithm in ('md5', 'sha256', 'sha512'):
+            encoded[algorithm] = value
+    digests = {}
+    for algorithm, value in encoded.items():
+        try:
+            digests[algorithm] = base64.b64decode(value, validate=True).hex()
+        except ValueError:
+            pass
+    return digests
+
+
+def check_zip(path, size):
+    """
+    This function validates the central directory of a zip file. Only the
+    end of the file is read, the members are not decompressed.
+
+    Parameters
+    ----------
+    path : str
+        zip file path.
+    size : int
+        file size.
+
+    Raises
+    ------
+    IntegrityError
+        the central directory is missing, malformed or points past the
+        end of the file.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            members = zf.infolist()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise IntegrityError(f'{path} is not a valid zip file ({e})', path) from e
+    for member in members:
+        if member.header_offset + member.compress_size > size:
+            raise IntegrityError(f'{path} member {member.filename} ends past the end of the file',
+                                 path)
+
+
+class Manifest:
+    """
+    Checksums of the downloaded files, kept in a JSON file next to them
+
+    Parameters
+    ----------
+    path : str
+        manifest file path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, file_name) -> dict:
+        """
+        This function returns the size and checksums of file_name, or None
+        when it is not in the manifest
+        """
+        with self.lock:
+            return self._read().get(file_name)
+
+    def entries(self) -> dict:
+        """
+        This function returns every entry of the manifest by file name
+        """
+        with self.lock:
+            return self._read()
+
+    def put(self, file_name, entry):
+        """
+        This function records the size and checksums of file_name
+
+        Parameters
+        ----------
+        file_name : str
+            file name in DATA_PATH.
+        entry : dict
+            size and hex digest for each algorithm.
+
+        Returns
+        -------
+        None.
+        """
+        with self.lock:
+            entries = self._read()
+            entries[file_name] = entry
+            self._write(entries)
+
+    def update(self, file_name, **fields):
+        """
+        This function adds fields to the entry of file_name
+
+        Parameters
+        ----------
+        file_name : str
+            file name in DATA_PATH.
+        **fields
+            values to set.
+
+        Returns
+        -------
+        None.
+        """
+        with self.lock:
+            entries = self._read()
+            entries.setdefault(file_name, {}).update(fields)
+            self._write(entries)
+
+    def _write(self, entries):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
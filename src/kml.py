@@ -0,0 +1,198 @@
+import numpy as np
+from lxml import etree
+
+KML_NS = '{http://www.opengis.net/kml/2.2}'
+
+
+def parse_coordinates(text) -> np.ndarray:
+    """
+    This function parses a KML coordinates string in C, without a Python
+    object per value
+
+    Parameters
+    ----------
+    text : str
+        whitespace separated lon,lat[,alt] tuples.
+
+    Returns
+    -------
+    np.ndarray
+        (n, 2) float array of longitude, latitude.
+    """
+    first = text.split(None, 1)
+    if not first:
+        return np.empty((0, 2))
+    dims = first[0].count(',') + 1
+    values = np.fromstring(text.replace(',', ' '), sep=' ')
+    if values.size % dims or text.count(',') != values.size // dims * (dims - 1):
+        # mixed 2D and 3D tuples
+        return np.array([t.split(',')[:2] for t in text.split()], dtype=float)
+    return values.reshape(-1, dims)[:, :2]
+
+
+class KMLPolygons:
+    """
+    Every polygon of a KML file, including inner rings and the polygons of
+    MultiGeometry placemarks. The vertices of all the rings are stored in
+    one (n, 2) longitude, latitude array, indexed by offset arrays.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        (n, 2) vertices of all the rings.
+    ring_offsets : np.ndarray
+        start of each ring in coords, plus n.
+    polygon_rings : np.ndarray
+        first ring of each polygon, plus the number of rings. The first
+        ring of a polygon is its outer boundary.
+    placemark_polygons : np.ndarray
+        first polygon of each placemark, plus the number of polygons.
+    names : list
+        name of each placemark, None when it has none.
+    """
+
+    def __init__(self, coords, ring_offsets, polygon_rings, placemark_polygons, names):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_rings = polygon_rings
+        self.placemark_polygons = placemark_polygons
+        self.names = names
+
+    @classmethod
+    def from_rings(cls, placemarks) -> 'KMLPolygons':
+        """
+        This function packs parsed rings into a KMLPolygons
+
+        Parameters
+        ----------
+        placemarks : list
+            (name, polygons) for each placemark, where polygons is a list of
+            ring lists, outer boundary first. Empty rings and placemarks
+            without polygons are dropped.
+
+        Returns
+        -------
+        KMLPolygons
+        """
+        rings, ring_counts, polygon_counts, names = [], [], [], []
+        for name, polygons in placemarks:
+            polygons = [[ring for ring in polygon if len(ring)] for polygon in polygons]
+            polygons = [polygon for polygon in polygons if polygon]
+            if not polygons:
+                continue
+            names.append(name)
+            polygon_counts.append(len(polygons))
+            for polygon in polygons:
+                ring_counts.append(len(polygon))
+                rings.extend(polygon)
+        coords = np.concatenate(rings) if rings else np.empty((0, 2))
+        ring_offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings], dtype=int)])
+        polygon_rings = np.concatenate([[0], np.cumsum(ring_counts, dtype=int)])
+        placemark_polygons = np.concatenate([[0], np.cumsum(polygon_counts, dtype=int)])
+        return cls(coords, ring_offsets, polygon_rings, placemark_polygons, names)
+
+    @classmethod
+    def read(cls, kml_file) -> 'KMLPolygons':
+        """
+        This function reads every polygon placemark of a KML file. The file
+        is streamed with iterparse and each placemark is freed once read, so
+        no tree of the whole document is built.
+
+        Parameters
+        ----------
+        kml_file : str
+            path to the KML file.
+
+        Returns
+        -------
+        KMLPolygons
+        """
+        placemarks = []
+        name, polygons, outer, inners = None, [], None, []
+        boundary = None
+        tags = [f'{KML_NS}{tag}' for tag in ('Placemark', 'name', 'Polygon', 'outerBoundaryIs',
+                                             'innerBoundaryIs', 'coordinates')]
+        for event, elem in etree.iterparse(kml_file, events=('start', 'end'), tag=tags):
+            tag = elem.tag[len(KML_NS):]
+            if event == 'start':
+                if tag == 'Placemark':
+                    name, polygons = None, []
+                elif tag == 'Polygon':
+                    outer, inners = None, []
+                elif tag in ('outerBoundaryIs', 'innerBoundaryIs'):
+                    boundary = tag
+                continue
+            if tag == 'coordinates' and boundary is not None:
+                ring = parse_coordinates(elem.text or '')
+                if boundary == 'outerBoundaryIs':
+                    outer = ring
+                else:
+                    inners.append(ring)
+            elif tag in ('outerBoundaryIs', 'innerBoundaryIs'):
+                boundary = None
+            elif tag == 'Polygon' and outer is not None:
+                polygons.append([outer] + inners)
+            elif tag == 'name' and elem.getparent().tag == f'{KML_NS}Placemark':
+                name = elem.text.strip() if elem.text else None
+            elif tag == 'Placemark':
+                placemarks.append((name, polygons))
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        return cls.from_rings(placemarks)
+
+    def __len__(self):
+        return len(self.polygon_rings) - 1
+
+    def placemark(self, i) -> 'KMLPolygons':
+        """
+        This function returns the polygons of placemark i alone
+        """
+        first, last = self.placemark_polygons[i], self.placemark_polygons[i + 1]
+        first_ring, last_ring = self.polygon_rings[first], self.polygon_rings[last]
+        start, end = self.ring_offsets[first_ring], self.ring_offsets[last_ring]
+        return KMLPolygons(self.coords[start: end],
+                           self.ring_offsets[first_ring: last_ring + 1] - start,
+                           self.polygon_rings[first: last + 1] - first_ring,
+                           np.array([0, last - first]), [self.names[i]])
+
+    def rings(self, i) -> list:
+        """
+        This function returns the rings of polygon i, outer boundary first
+        """
+        first, last = self.polygon_rings[i], self.polygon_rings[i + 1]
+        return [self.coords[start: end]
+                for start, end in zip(self.ring_offsets[first: last], self.ring_offsets[first + 1: last + 1])]
+
+    def _bounds(self, starts) -> np.ndarray:
+        # Inner rings lie inside their outer ring, so the vertices from one
+        # start to the next have the bounds of the outer ring
+        if not len(starts):
+            return np.empty((0, 4))
+        return np.hstack([np.minimum.reduceat(self.coords, starts),
+                          np.maximum.reduceat(self.coords, starts)])
+
+    def bounds(self) -> np.ndarray:
+        """
+        This function computes the bounding box of every polygon
+
+        Returns
+        -------
+        np.ndarray
+            (polygons, 4) min longitude, min latitude, max longitude,
+            max latitude.
+        """
+        return self._bounds(self.ring_offsets[self.polygon_rings[:-1]])
+
+    def union_bounds(self) -> np.ndarray:
+        """
+        This function computes the bounding box of all the polygons
+
+        Returns
+        -------
+        np.ndarray
+            min longitude, min latitude, max longitude, max latitude.
+        """
+        if not len(self.coords):
+            raise ValueError('The KML file has no polygons')
+        return np.concatenate([self.coords.min(axis=0), self.coords.max(axis=0)])
@@ -0,0 +1,200 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import poll_interval, poll_max_interval, poll_backoff, poll_jitter, poll_timeout, max_workers
+
+
+def expected_downloads(label, downloads, requested, logger) -> int:
+    """
+    This function counts the downloads of a download-request that will
+    become available under its label. Failed products never will, and
+    duplicate products stay under the label they were first requested
+    with, so neither is waited for.
+
+    Parameters
+    ----------
+    label : str
+        label of the download request.
+    downloads : list
+        entityId and productId dict for each requested scene.
+    requested : dict
+        download-request response.
+    logger : logging.Logger
+        logger to report the failed and duplicate products to.
+
+    Returns
+    -------
+    int
+        number of downloads to wait for.
+    """
+    failed = requested.get('failed') or []
+    duplicates = requested.get('duplicateProducts') or []
+    if failed:
+        logger.warning(f'{len(failed)} downloads from {label} failed: {failed}')
+    if duplicates:
+        logger.warning(f'{len(duplicates)} downloads from {label} were already requested '
+                       f'under another label: {duplicates}')
+    return len(downloads) - len(failed) - len(duplicates)
+
+
+def ready_download(download) -> tuple:
+    """
+    This function returns the downloadId and the url and entityId of an
+    available download, None when it has no url or entityId
+    """
+    if not download.get('url') or not download.get('entityId'):
+        return None
+    return download['downloadId'], {'entityId': download['entityId'], 'url': download['url']}
+
+
+class DownloadPoller:
+    """
+    Polls download-retrieve for many download-request labels at once.
+    Each label has its own schedule: it starts at a short interval, backs
+    off exponentially (with jitter) while nothing new is ready, and is
+    polled again at the short interval as soon as downloads become ready.
+    A label is dropped once its downloads are all available, or timeout
+    seconds after it was added.
+    """
+
+    def __init__(self,
+                 client,
+                 interval: float = poll_interval,
+                 max_interval: float = poll_max_interval,
+                 backoff: float = poll_backoff,
+                 jitter: float = poll_jitter,
+                 timeout: float = poll_timeout,
+                 max_workers: int = max_workers):
+        self.client = client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.labels = {}
+        self.queued = []
+        self.lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of labels with downloads that are not available yet, plus
+        the available downloads not returned by poll yet
+        """
+        with self.lock:
+            return len(self.labels) + len(self.queued)
+
+    def add(self, label, count, available=()):
+        """
+        This function starts polling a download-request label
+
+        Parameters
+        ----------
+        label : str
+            label of the download request.
+        count : int
+            number of downloads that will become available under the label.
+        available : list, optional
+            availableDownloads of the download-request response. They are
+            returned by the next poll. The default is ().
+
+        Returns
+        -------
+        None.
+
+        """
+        now = time.monotonic()
+        state = {'count': count,
+                 'ready': set(),
+                 'interval': self.interval,
+                 'next': now,
+                 'deadline': now + self.timeout}
+        with self.lock:
+            for download in available:
+                ready = ready_download(download)
+                if ready is not None and ready[0] not in state['ready']:
+                    state['ready'].add(ready[0])
+                    self.queued.append(ready)
+            if len(state['ready']) < count:
+                self.labels[label] = state
+
+    def _retrieve(self, label) -> dict:
+        return self.client.send_request('download-retrieve', {'label': label}, self.client.api_key)
+
+    def poll(self) -> list:
+        """
+        This function calls download-retrieve, concurrently, for every
+        label that is due and reschedules the labels that are not complete
+
+        Returns
+        -------
+        list
+            (downloadId, {'entityId': ..., 'url': ...}) for each download
+            that became available since the last poll.
+
+        """
+        now = time.monotonic()
+        with self.lock:
+            ready_downloads, self.queued = self.queued, []
+            due = [label for label, state in self.labels.items() if state['next'] <= now]
+        if not due:
+            return ready_downloads
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._retrieve, due))
+
+        for label, retrieved in zip(due, results):
+            state = self.labels[label]
+            new_downloads = []
+            for download in retrieved['available']:
+                ready = ready_download(download)
+                if ready is not None and ready[0] not in state['ready']:
+                    state['ready'].add(ready[0])
+                    new_downloads.append(ready)
+            ready_downloads.extend(new_downloads)
+            preparing_downloads = state['count'] - len(state['ready'])
+            if preparing_downloads <= 0:
+                self.client.logger.info(f'All {state["count"]} downloads from {label} are available to download.')
+                with self.lock:
+                    del self.labels[label]
+                continue
+            if time.monotonic() >= state['deadline']:
+                self.client.logger.warning(f'{preparing_downloads} downloads from {label} are still not '
+                                           f'available after {self.timeout:.0f} seconds, giving up on them.')
+                with self.lock:
+                    del self.labels[label]
+                continue
+            if new_downloads:
+                state['interval'] = self.interval
+            else:
+                state['interval'] = min(state['interval'] * self.backoff, self.max_interval)
+            delay = state['interval'] * random.uniform(1 - self.jitter, 1 + self.jitter)
+            state['next'] = time.monotonic() + delay
+            self.client.logger.info(f'{preparing_downloads} downloads from {label} are not available. '
+                                    f'Polling again in {delay:.0f} seconds.')
+        return ready_downloads
+
+    def wait(self, timeout: float = None):
+        """
+        This function sleeps until the next label is due to be polled
+
+        Parameters
+        ----------
+        timeout : float, optional
+            max number of seconds to sleep. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            if not self.labels or self.queued:
+                return
+            delay = min(state['next'] for state in self.labels.values()) - time.monotonic()
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill at rate per second up to
+    capacity. A caller that takes more tokens than are left reserves them
+    and waits until they have been refilled, so callers are served in order.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens=1) -> float:
+        """
+        This function takes tokens from the bucket without waiting
+
+        Parameters
+        ----------
+        tokens : float, optional
+            number of tokens to take. The default is 1.
+
+        Returns
+        -------
+        float
+            seconds to wait before using the tokens.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        """
+        This function takes tokens from the bucket, waiting until they are
+        available
+
+        Parameters
+        ----------
+        tokens : float, optional
+            number of tokens to take. The default is 1.
+
+        Returns
+        -------
+        None.
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """
+    Token bucket kept in a SQLite file, so processes on the same machine
+    share one budget
+    """
+
+    def __init__(self, path, name, rate, capacity):
+        super().__init__(rate, capacity)
+        self.name = name
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                          check_same_thread=False)
+        with self.lock:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                                    'name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def reserve(self, tokens=1) -> float:
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.connection.execute('SELECT tokens, updated FROM buckets WHERE name = ?',
+                                              (self.name,)).fetchone()
+                now = time.time()
+                available, updated = row if row else (self.capacity, now)
+                available = min(self.capacity, available + (now - updated) * self.rate) - tokens
+                self.connection.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                                        (self.name, available, now))
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return max(0.0, -available / self.rate)
+
+
+class RateLimiter:
+    """
+    Per-endpoint request budgets. Each endpoint in limits gets its own
+    bucket, the other endpoints share the 'default' bucket (no limit if
+    there is none). With a path, the buckets are shared across processes.
+    """
+
+    def __init__(self, limits, path=None):
+        self.limits = limits
+        self.path = path
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, endpoint) -> TokenBucket:
+        name = endpoint if endpoint in self.limits else 'default'
+        if name not in self.limits:
+            return None
+        with self.lock:
+            if name not in self.buckets:
+                rate, capacity = self.limits[name]
+                if self.path:
+                    self.buckets[name] = SQLiteTokenBucket(self.path, name, rate, capacity)
+                else:
+                    self.buckets[name] = TokenBucket(rate, capacity)
+            return self.buckets[name]
+
+    def reserve(self, endpoint) -> float:
+        """
+        This function takes a request token for an endpoint without waiting
+
+        Parameters
+        ----------
+        endpoint : str
+            M2M request type.
+
+        Returns
+        -------
+        float
+            seconds to wait before sending the request.
+        """
+        bucket = self.bucket(endpoint)
+        return bucket.reserve() if bucket is not None else 0.0
+
+    def acquire(self, endpoint):
+        """
+        This function waits until a request to an endpoint is within budget
+
+        Parameters
+        ----------
+        endpoint : str
+            M2M request type.
+
+        Returns
+        -------
+        None.
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class SyncState:
+    """
+    Local SQLite record of what was already fetched, so a rerun only
+    searches the new acquisition window and skips known scenes. For each
+    AOI (KML file) and dataset it keeps the end of the last window that
+    was fully downloaded and every entityId that was downloaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS windows ('
+                                    'aoi TEXT, dataset TEXT, start TEXT, end TEXT, '
+                                    'PRIMARY KEY (aoi, dataset))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS entities ('
+                                    'aoi TEXT, dataset TEXT, entity_id TEXT, fetched TEXT, '
+                                    'PRIMARY KEY (aoi, dataset, entity_id))')
+
+    def last_end(self, aoi, dataset) -> str:
+        """
+        This function returns the end of the last fully downloaded window
+
+        Parameters
+        ----------
+        aoi : str
+            AOI name (the KML file).
+        dataset : str
+            dataset alias.
+
+        Returns
+        -------
+        str
+            end date (YYYY-MM-DD), or None if the AOI and dataset were
+            never synced.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT end FROM windows WHERE aoi = ? AND dataset = ?',
+                                          (aoi, dataset)).fetchone()
+        return row[0] if row else None
+
+    def set_window(self, aoi, dataset, start, end):
+        """
+        This function records a fully downloaded acquisition window
+
+        Parameters
+        ----------
+        aoi : str
+            AOI name (the KML file).
+        dataset : str
+            dataset alias.
+        start : str
+            start date (YYYY-MM-DD).
+        end : str
+            end date (YYYY-MM-DD).
+
+        Returns
+        -------
+        None.
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?)',
+                                    (aoi, dataset, start, end))
+
+    def known_entities(self, aoi, dataset) -> set:
+        """
+        This function returns the entityIds already downloaded
+
+        Parameters
+        ----------
+        aoi : str
+            AOI name (the KML file).
+        dataset : str
+            dataset alias.
+
+        Returns
+        -------
+        set
+            downloaded entityIds.
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT entity_id FROM entities WHERE aoi = ? AND dataset = ?',
+                                           (aoi, dataset)).fetchall()
+        return {row[0] for row in rows}
+
+    def add_entities(self, aoi, dataset, entity_ids):
+        """
+        This function records downloaded entityIds
+
+        Parameters
+        ----------
+        aoi : str
+            AOI name (the KML file).
+        dataset : str
+            dataset alias.
+        entity_ids : iterable
+            downloaded entityIds.
+
+        Returns
+        -------
+        None.
+        """
+        fetched = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)',
+                                        [(aoi, dataset, entity_id, fetched) for entity_id in entity_ids])
+
+    def close(self):
+        """
+        This function closes the database
+
+        Returns
+        -------
+        None.
+        """
+        self.connection.close()